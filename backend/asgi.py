@@ -0,0 +1,24 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+and switches the backend over to its async request path, so that one worker
+can keep many slow upstream fetches in flight at once.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+application = get_asgi_application()
+
+# Settings may already have been loaded by gunicorn's post_fork hook, so switch
+# to the async views here rather than through the environment. The URLconf is
+# only loaded on the first request, after this.
+settings.MEMES_ASYNC = True
@@ -1,10 +1,11 @@
 """
 HTTP client configuration with connection pooling and artificial delays.
 
-This module creates a global httpx client and provides patching functionality
-for adding artificial delays to imgflip.com requests.
+This module creates global sync and async httpx clients and provides patching
+functionality for adding artificial delays to imgflip.com requests.
 """
 
+import asyncio
 import random
 import time
 from urllib.parse import urlparse
@@ -26,6 +27,19 @@ def _patched_handle_request(self, request):
     return _original_handle_request(self, request)
 
 
+_original_handle_async_request = httpx.AsyncHTTPTransport.handle_async_request
+
+
+async def _patched_handle_async_request(self, request):
+    """Patched AsyncHTTPTransport.handle_async_request with the same imgflip.com delay."""
+    if request.url.host and "imgflip.com" in request.url.host:
+        delay = random.gammavariate(alpha=2, beta=2)
+        print(f"delay: {delay}")
+        await asyncio.sleep(delay)
+
+    return await _original_handle_async_request(self, request)
+
+
 # Patch is not applied automatically - call patch_imgflip_delay() to enable
 
 # Global HTTP client with larger connection pool for backend image fetching
@@ -39,7 +53,20 @@ httpx_client = httpx.Client(
     follow_redirects=True,
 )
 
+# The same for the async (ASGI) request path. Only use this from the event loop
+# that the ASGI server runs, as its connections belong to that loop.
+async_httpx_client = httpx.AsyncClient(
+    timeout=15.0,
+    limits=httpx.Limits(
+        max_keepalive_connections=50,
+        max_connections=500,  # one worker can have hundreds of slow fetches in flight
+        keepalive_expiry=60.0,
+    ),
+    follow_redirects=True,
+)
+
 
 def patch_imgflip_delay():
-    """Apply the imgflip delay patch to the httpx client."""
+    """Apply the imgflip delay patch to the httpx clients."""
     httpx.HTTPTransport.handle_request = _patched_handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = _patched_handle_async_request
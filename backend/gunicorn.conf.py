@@ -1,4 +1,6 @@
 # Gunicorn server configuration
+import os
+
 from dotenv import load_dotenv
 from tracing import setup_tracing
 import logging
@@ -35,8 +37,9 @@ class ColoredFormatter(logging.Formatter):
         return formatted
 
 
-# use the default synchronous worker
-workers = 4
+# use the default synchronous worker. settings.py reads WEB_CONCURRENCY too, to
+# share the CPUs out between the workers' render pools
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
 worker_class = "sync"
 # reload on code chagnes
 reload = True
@@ -88,5 +91,50 @@ def post_fork(server, worker):
     """Gunicorn hook that is called after a new worker process is started."""
     # Reload .env file to pick up any changes - this is a convenience for the workshop
     load_dotenv(".env", override=True)
+    # find and parse the meme font now, rather than on the first request
+    from memes.executor import render_executor
+    from memes.fonts import warm_fonts
+
+    font_path = warm_fonts()
+    server.log.info(f"Warmed fonts ({font_path}) for worker {worker.pid}")
+    # start the render pool before tracing starts its export thread, so we
+    # fork the pool processes from a single threaded process. They set up
+    # their own tracing as they start
+    render_executor.warm()
+    server.log.info(
+        f"Started {render_executor.max_workers} render processes for worker {worker.pid}"
+    )
     # setup our tracing in the new worker process
     setup_tracing(server, worker)
+    # pick up any memes a previous worker left to render in the background
+    import django
+
+    django.setup()
+    from django.db import DatabaseError
+    from memes.views import resume_jobs
+
+    try:
+        resumed = resume_jobs()
+    except DatabaseError as e:
+        # e.g. migrations haven't been run yet
+        server.log.warning(f"Could not resume pending memes: {e}")
+    else:
+        if resumed:
+            server.log.info(f"Resumed {resumed} pending memes in worker {worker.pid}")
+    # and upload any images a previous worker left in the storage spool
+    from django.core.files.storage import default_storage
+
+    recovered = default_storage.recover()
+    if recovered:
+        server.log.info(f"Recovered {recovered} spooled images in worker {worker.pid}")
+
+
+def worker_exit(server, worker):
+    """Gunicorn hook that is called just after a worker has exited."""
+    from django.core.files.storage import default_storage
+    from memes.executor import render_executor
+    from memes.jobs import job_queue
+
+    job_queue.shutdown()
+    render_executor.shutdown()
+    default_storage.shutdown()
@@ -0,0 +1,183 @@
+"""
+Small in-process caches used by the meme rendering pipeline.
+
+Each gunicorn worker gets its own copy of these, so they are only ever shared
+between requests served by the same process.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# every cache registers itself here so we can report on them all in one place
+_registry = {}
+
+
+class LRUCache:
+    """Thread-safe LRU cache that counts its hits, misses and evictions.
+
+    It can be bounded by number of items, total size in bytes, or both. Sizes
+    are measured with ``sizeof``, which defaults to ``len``. With a ``ttl``,
+    items are also dropped that many seconds after they were set.
+    """
+
+    def __init__(self, name, max_items=None, max_bytes=None, sizeof=len, ttl=None):
+        self.name = name
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        register(name, self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # would evict everything else and still not fit
+                return
+            self._data[key] = (value, size, expires)
+            self.size += size
+            while self._over_budget():
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _discard(self, key):
+        if key in self._data:
+            _, size, _ = self._data.pop(key)
+            self.size -= size
+
+    def _over_budget(self):
+        if self.max_items is not None and len(self._data) > self.max_items:
+            return True
+        return self.max_bytes is not None and self.size > self.max_bytes
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "items": len(self._data),
+            "max_items": self.max_items,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+        if self.max_bytes is not None:
+            stats["bytes"] = self.size
+            stats["max_bytes"] = self.max_bytes
+        if self.ttl is not None:
+            stats["ttl"] = self.ttl
+            stats["expirations"] = self.expirations
+        return stats
+
+
+class HitCounter:
+    """Counts hits and misses for a cache whose storage lives elsewhere."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        register(name, self)
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def register(name, cache):
+    """Include a cache with its own ``stats()`` method in the stats report."""
+    _registry[name] = cache
+
+
+def reset_stats(names):
+    """Zero the counters of the named caches, e.g. in a newly forked process."""
+    for name in names:
+        if name in _registry:
+            _registry[name].reset_stats()
+
+
+def cache_stats():
+    """Return the stats for every cache in this process, keyed by name."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+# stats that add up across processes. The rest (limits, ttl) are per process
+SUMMED_STATS = ("items", "bytes", "hits", "misses", "evictions", "expirations")
+
+
+def merge_stats(reports):
+    """Combine one cache's stats() from several processes."""
+    merged = {"processes": len(reports)}
+    for report in reports:
+        for key, value in report.items():
+            if key in SUMMED_STATS:
+                merged[key] = merged.get(key, 0) + value
+            else:
+                merged.setdefault(key, value)
+    if "hit_ratio" in merged:
+        lookups = merged["hits"] + merged["misses"]
+        merged["hit_ratio"] = merged["hits"] / lookups if lookups else 0.0
+    return merged
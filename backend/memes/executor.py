@@ -0,0 +1,233 @@
+"""
+Process pool for the CPU-bound part of meme rendering.
+
+Request workers do the I/O (fetching source images, the database), and hand
+the Pillow work to a pool of processes, so rendering doesn't compete with I/O
+for the request worker's GIL. The number of renders waiting on the pool is
+bounded, and callers get RenderQueueFullError rather than queueing forever.
+
+The render caches (fonts, base images, layouts, overlays) live in the pool
+processes, so each process has its own. They report their cache stats back
+with every render, and stats() adds them up across the pool.
+"""
+
+import asyncio
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from opentelemetry import context, propagate, trace
+
+from memes.cache import cache_stats, merge_stats, register, reset_stats
+
+tracer = trace.get_tracer("memes.executor")
+
+
+# the caches the render functions use, and so that live in the pool processes
+POOL_CACHES = ("fonts", "base_images", "layouts", "layouts.shared", "overlays")
+
+
+class RenderQueueFullError(Exception):
+    """Raised when too many renders are already waiting for the pool."""
+
+
+def init_render_process():
+    """Runs in each pool process as it starts."""
+    from memes.fonts import warm_fonts
+    from tracing import setup_tracing
+
+    # count only our own work, not what the request worker did before forking
+    reset_stats(POOL_CACHES)
+    warm_fonts()
+    # the pool is forked before the request worker sets up tracing
+    provider = setup_tracing()
+    if provider is not None:
+        # pool processes exit without running atexit, so flush spans here
+        multiprocessing.util.Finalize(None, provider.shutdown, exitpriority=10)
+
+
+def timed_call(func, args, carrier):
+    """Run func in a pool process, as part of the caller's trace.
+
+    Returns when it actually started, the result, this process's pid and its
+    render cache stats.
+    """
+    token = context.attach(propagate.extract(carrier))
+    try:
+        started_at = time.time()
+        result = func(*args)
+    finally:
+        context.detach(token)
+    stats = {name: s for name, s in cache_stats().items() if name in POOL_CACHES}
+    return started_at, result, os.getpid(), stats
+
+
+class RenderExecutor:
+    """A lazily started process pool with a bounded number of pending renders."""
+
+    def __init__(self, max_workers, max_queued):
+        self.max_workers = max_workers
+        # renders allowed in flight: one running per process, plus the queue
+        self.max_pending = max_workers + max_queued
+        self.pending = 0
+        self.max_depth = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # the latest render cache stats from each pool process, by pid
+        self.process_stats = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        register("render_queue", self)
+
+    @property
+    def enabled(self):
+        return self.max_workers > 0
+
+    @property
+    def pool(self):
+        # created on first use, so it's never started in the gunicorn master
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    # fork, so the pool processes don't re-import gunicorn's
+                    # __main__ like spawn and forkserver would
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=init_render_process,
+                )
+            return self._pool
+
+    def run(self, func, *args):
+        """Run func(*args) in the pool, wait for it, and return the result.
+
+        Raises RenderQueueFullError if there are already max_pending renders.
+        """
+        if not self.enabled:
+            return func(*args)
+
+        with tracer.start_as_current_span(func.__name__) as span:
+            self._acquire(span)
+            submitted_at = time.time()
+            try:
+                future = self.pool.submit(timed_call, func, args, self._carrier())
+                done = future.result()
+            except BrokenProcessPool:
+                self._reset()
+                raise
+            finally:
+                self._release()
+            return self._finish(span, submitted_at, *done)
+
+    async def arun(self, func, *args):
+        """Async version of run, for the ASGI request path."""
+        if not self.enabled:
+            return await asyncio.to_thread(func, *args)
+
+        with tracer.start_as_current_span(func.__name__) as span:
+            self._acquire(span)
+            submitted_at = time.time()
+            try:
+                future = self.pool.submit(timed_call, func, args, self._carrier())
+                done = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                self._reset()
+                raise
+            finally:
+                self._release()
+            return self._finish(span, submitted_at, *done)
+
+    def _carrier(self):
+        # so spans in the pool process join the current trace
+        carrier = {}
+        propagate.inject(carrier)
+        return carrier
+
+    def _finish(self, span, submitted_at, started_at, result, pid, stats):
+        self._record_wait(span, started_at - submitted_at)
+        with self._lock:
+            self.process_stats[pid] = stats
+        return result
+
+    def _acquire(self, span):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                span.set_attribute("render_queue.rejected", True)
+                raise RenderQueueFullError(
+                    f"{self.pending} renders already pending, try again shortly"
+                )
+            self.pending += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.pending)
+            span.set_attribute("render_queue.depth", self.pending)
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def _reset(self):
+        # a pool process died, so start a fresh pool next time
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self.process_stats = {}
+        if pool is not None:
+            # the rest of its processes are being terminated, but let the
+            # pool clean up its threads and pipes
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _record_wait(self, span, wait):
+        wait = max(wait, 0.0)
+        span.set_attribute("render_queue.wait_ms", wait * 1000)
+        with self._lock:
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def warm(self):
+        """Start the pool processes now, rather than on the first render."""
+        if self.enabled:
+            # the pool runs init_render_process in each process as it starts,
+            # so all these need do is start them
+            futures = [self.pool.submit(os.getpid) for _ in range(self.max_workers)]
+            for future in futures:
+                future.result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def pool_cache_stats(self):
+        """The render cache stats, added up across the pool processes."""
+        with self._lock:
+            reports = list(self.process_stats.values())
+        names = {name for report in reports for name in report}
+        return {
+            name: merge_stats([report[name] for report in reports if name in report])
+            for name in sorted(names)
+        }
+
+    def stats(self):
+        completed = self.submitted - self.pending
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "depth": self.pending,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "mean_wait_ms": self.total_wait * 1000 / completed if completed else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+render_executor = RenderExecutor(
+    settings.MEMES_RENDER_WORKERS, settings.MEMES_RENDER_QUEUE_SIZE
+)
@@ -0,0 +1,101 @@
+"""
+Process-wide registry of the fonts used to draw meme captions.
+
+Finding and parsing the Impact TTF is expensive, and caption sizing asks for
+the font at lots of different sizes, so we look up the font file once per
+process and keep the parsed fonts in a bounded LRU keyed by size.
+"""
+
+import os
+import threading
+
+from django.conf import settings
+from PIL import ImageFont
+
+from memes.cache import LRUCache
+
+# System fonts to fall back to if the bundled Impact fonts are missing
+FALLBACK_FONTS = [
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf",
+]
+
+
+def font_candidates():
+    """Font paths to try, in order of preference."""
+    fonts_dir = os.path.join(settings.MEDIA_ROOT, "fonts")
+    return [
+        # unicode Impact font first for emoji support
+        os.path.join(fonts_dir, "unicode.impact.ttf"),
+        os.path.join(fonts_dir, "impact.ttf"),
+        # Fallback to project media directory
+        "/home/wavy/otelmewhy/media/fonts/unicode.impact.ttf",
+        "/home/wavy/otelmewhy/media/fonts/impact.ttf",
+        *FALLBACK_FONTS,
+    ]
+
+
+class FontRegistry:
+    """Finds the meme font once and caches loaded fonts by size."""
+
+    def __init__(self, max_fonts):
+        self.fonts = LRUCache("fonts", max_fonts)
+        self._path = None
+        self._resolved = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path of the font in use, or None if we fell back to Pillow's default."""
+        if not self._resolved:
+            self.resolve()
+        return self._path
+
+    def resolve(self):
+        """Find the first usable font file. Only touches the filesystem once."""
+        with self._lock:
+            if self._resolved:
+                return self._path
+            for candidate in font_candidates():
+                if not os.path.exists(candidate):
+                    continue
+                try:
+                    ImageFont.truetype(candidate, 10)
+                except OSError:
+                    continue
+                self._path = candidate
+                break
+            self._resolved = True
+            return self._path
+
+    def get(self, size):
+        """Return the font at the given size, loading it if needed."""
+        font = self.fonts.get(size)
+        if font is None:
+            if self.path is None:
+                font = ImageFont.load_default()
+            else:
+                font = ImageFont.truetype(self.path, size)
+            self.fonts.set(size, font)
+        return font
+
+    def warm(self, sizes=()):
+        """Resolve the font path and pre-load some sizes, e.g. at worker start."""
+        self.resolve()
+        for size in sizes:
+            self.get(size)
+
+    def reset(self):
+        with self._lock:
+            self._path = None
+            self._resolved = False
+        self.fonts.clear()
+
+
+font_registry = FontRegistry(settings.MEMES_FONT_CACHE_SIZE)
+
+
+def warm_fonts():
+    """Warm the font registry for this process."""
+    font_registry.warm(settings.MEMES_FONT_WARM_SIZES)
+    return font_registry.path
@@ -0,0 +1,74 @@
+"""
+In-process queue for creating memes in the background.
+
+In job mode, create_meme saves a pending Meme and returns straight away, and
+a thread from this queue fetches and renders it. There's no broker: the Meme
+rows are the durable state, and whichever worker moves a row out of pending
+first runs it, so a restarted worker can pick up memes left pending.
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from memes.cache import register
+
+
+class JobQueue:
+    """A lazily started thread pool that counts what it has run."""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        register(name, self)
+
+    @property
+    def executor(self):
+        # created on first use, so it's never started in the gunicorn master
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+            return self._executor
+
+    def submit(self, func, *args):
+        """Run func(*args) in the background, in the caller's trace context."""
+        future = self.executor.submit(contextvars.copy_context().run, func, *args)
+        with self._lock:
+            self.submitted += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            if not future.cancelled() and future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def shutdown(self):
+        # anything not started yet stays pending in the database
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "queued": self.submitted - self.completed - self.failed,
+        }
+
+
+job_queue = JobQueue("jobs", settings.MEMES_JOB_WORKERS)
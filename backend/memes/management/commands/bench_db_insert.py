@@ -0,0 +1,119 @@
+"""
+Benchmark concurrent Meme inserts from several processes, like gunicorn workers.
+
+    uv run python manage.py bench_db_insert
+    uv run python manage.py bench_db_insert --processes 8 --inserts 500
+
+Each insert looks for an existing meme with the same content hash, then saves
+a new one, in one transaction, much like create_meme with dedupe on. Every
+configuration gets a fresh database in a temporary directory.
+"""
+
+import multiprocessing
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from memes.models import Meme
+
+WAL_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout = 5000;
+""".strip()
+
+# (label, OPTIONS) to compare. None means the configured OPTIONS
+CONFIGS = [
+    ("django default", {}),
+    ("wal", {"init_command": WAL_PRAGMAS}),
+    ("configured", None),
+]
+
+
+def use_database(path, options):
+    connection.close()
+    connection.settings_dict["NAME"] = path
+    connection.settings_dict["OPTIONS"] = options
+
+
+def insert(path, options, count, barrier, results):
+    """Insert count memes, and put (elapsed, locked errors) on results."""
+    use_database(path, options)
+    locked = 0
+    barrier.wait()
+    start = time.perf_counter()
+    for _ in range(count):
+        content_hash = uuid.uuid4().hex
+        try:
+            with transaction.atomic():
+                Meme.objects.filter(content_hash=content_hash).first()
+                Meme.objects.create(
+                    image_url="https://example.com/template.png",
+                    top_text="ONE DOES NOT SIMPLY",
+                    bottom_text="LOCK THE DATABASE",
+                    generated_image=f"memes/{content_hash}.png",
+                    content_hash=content_hash,
+                )
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    elapsed = time.perf_counter() - start
+    connection.close()
+    results.put((elapsed, locked))
+
+
+class Command(BaseCommand):
+    help = "Compare insert throughput and lock errors for SQLite configurations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--inserts", type=int, default=250)
+
+    def handle(self, *args, **options):
+        configured = dict(settings.DATABASES["default"]["OPTIONS"])
+        processes, inserts = options["processes"], options["inserts"]
+        total = processes * inserts
+        self.stdout.write(
+            f"{processes} processes x {inserts} inserts\n"
+            f"{'config':>15} {'inserts/s':>10} {'locked':>8} {'error rate':>10}"
+        )
+
+        context = multiprocessing.get_context("fork")
+        for label, db_options in CONFIGS:
+            db_options = configured if db_options is None else db_options
+            with tempfile.TemporaryDirectory() as directory:
+                path = str(Path(directory) / "bench.sqlite3")
+                use_database(path, db_options)
+                call_command("migrate", verbosity=0)
+                connection.close()
+
+                # everyone starts inserting at once, to get the most contention
+                barrier = context.Barrier(processes)
+                queue = context.Queue()
+                workers = [
+                    context.Process(
+                        target=insert,
+                        args=(path, db_options, inserts, barrier, queue),
+                    )
+                    for _ in range(processes)
+                ]
+                for worker in workers:
+                    worker.start()
+                results = [queue.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+
+            # the slowest process decides how long the whole run took
+            elapsed = max(elapsed for elapsed, _ in results)
+            locked = sum(locked for _, locked in results)
+            self.stdout.write(
+                f"{label:>15} {(total - locked) / elapsed:>10.0f} {locked:>8} "
+                f"{locked / total:>10.1%}"
+            )
@@ -0,0 +1,95 @@
+"""
+Benchmark rendering large source images at full size against downscaling them.
+
+    uv run python manage.py bench_downscale
+    uv run python manage.py bench_downscale --sizes 4000x3000 8000x6000 --max-size 1200
+"""
+
+import io
+import multiprocessing
+import resource
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from memes.utils import base_images, get_base_image, image_nbytes, render_meme
+
+DEFAULT_SIZES = ["3000x2000", "6000x4000", "8000x6000"]
+
+
+def synthetic_source(width, height, pil_format):
+    """A noisy gradient photo stand-in, so encoders can't cheat on flat colour."""
+    image = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge(
+        "RGB", (image, noise, image.transpose(Image.Transpose.FLIP_TOP_BOTTOM))
+    )
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, max(width // 20, 1)):
+        draw.line((i, 0, width - i, height), fill=(255, 255 - i % 255, 0), width=5)
+    output = io.BytesIO()
+    image.save(output, format=pil_format, quality=90)
+    return output.getvalue()
+
+
+def measure(content, max_size, output_format, repeat):
+    """Render in a forked process, so each case gets its own peak RSS."""
+    settings.MEMES_MAX_OUTPUT_SIZE = max_size
+    base_images.clear()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for i in range(repeat):
+        # a new validator each time, so every render decodes the source
+        output = render_meme(
+            "bench", str(i), content, "ONE DOES NOT SIMPLY", "DOWNSCALE", output_format
+        )
+    elapsed = (time.perf_counter() - start) / repeat
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    # what one decoded source costs to hold in the base image cache
+    decoded = image_nbytes(get_base_image("bench", "size", content))
+    return elapsed, len(output.content), decoded, rss_growth
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare render time and memory for large sources with and without downscaling"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES)
+        parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+        parser.add_argument(
+            "--max-size", type=int, default=settings.MEMES_MAX_OUTPUT_SIZE or 1600
+        )
+        parser.add_argument("--output-format", default="png")
+        parser.add_argument("--repeat", type=int, default=2)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'source':>15} {'max size':>9} {'render':>10} {'output':>10} "
+            f"{'decoded':>9} {'peak rss':>9}"
+        )
+        context = multiprocessing.get_context("fork")
+        for pil_format in options["formats"]:
+            for size in options["sizes"]:
+                width, height = (int(n) for n in size.split("x"))
+                content = synthetic_source(width, height, pil_format)
+                for max_size in (0, options["max_size"]):
+                    with context.Pool(1, maxtasksperchild=1) as pool:
+                        elapsed, output, decoded, rss = pool.apply(
+                            measure,
+                            (
+                                content,
+                                max_size,
+                                options["output_format"],
+                                options["repeat"],
+                            ),
+                        )
+                    self.stdout.write(
+                        f"{pil_format.lower() + ' ' + size:>15} "
+                        f"{max_size or 'none':>9} {elapsed * 1000:>8.0f}ms "
+                        f"{output / 1024:>8.0f}KB {decoded / 2**20:>7.1f}MB "
+                        f"{rss / 1024:>7.1f}MB"
+                    )
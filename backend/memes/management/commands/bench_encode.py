@@ -0,0 +1,103 @@
+"""
+Benchmark encode time against output size for each output format.
+
+    uv run python manage.py bench_encode
+    uv run python manage.py bench_encode --templates media/memes/meme.png
+"""
+
+import json
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from memes.utils import OUTPUT_FORMATS, convert_to_rgb, load_base_image
+
+# (label, format, save options) to compare
+CONFIGS = [
+    ("png level 1", "PNG", {"compress_level": 1}),
+    ("png level 6", "PNG", {"compress_level": 6}),
+    ("png level 9", "PNG", {"compress_level": 9}),
+    ("png optimize", "PNG", {"optimize": True}),
+    ("webp q80", "WEBP", {"quality": 80, "method": 4}),
+    ("webp q80 m0", "WEBP", {"quality": 80, "method": 0}),
+    ("webp lossless", "WEBP", {"lossless": True}),
+    ("jpeg q85", "JPEG", {"quality": 85, "progressive": True}),
+    ("jpeg q75", "JPEG", {"quality": 75}),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare PNG, WebP and JPEG encode time and size on meme templates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data",
+            default=str(settings.BASE_DIR.parent / "frontend" / "test-data.json"),
+            help="JSON file of memes to take template image urls from",
+        )
+        parser.add_argument(
+            "--templates",
+            nargs="+",
+            help="Local image files to use instead of fetching the test-data urls",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        images = self.load_templates(options)
+        if not images:
+            raise CommandError("Could not load any templates")
+        pixels = sum(image.width * image.height for image in images)
+        self.stdout.write(
+            f"{len(images)} templates, {pixels / len(images) / 1e6:.2f} Mpx on average"
+        )
+        self.stdout.write(
+            f"{'config':>15} {'encode':>10} {'size':>10} {'vs png 6':>9}  "
+            f"(configured formats: {', '.join(OUTPUT_FORMATS)})"
+        )
+
+        results = []
+        for label, pil_format, save_options in CONFIGS:
+            elapsed = 0.0
+            size = 0
+            for _ in range(options["repeat"]):
+                for image in images:
+                    start = time.perf_counter()
+                    encoded = self.encode(image, pil_format, save_options)
+                    elapsed += time.perf_counter() - start
+                    size += encoded
+            runs = options["repeat"] * len(images)
+            results.append((label, elapsed / runs, size / runs))
+
+        baseline = {label: size for label, _, size in results}["png level 6"]
+        for label, elapsed, size in results:
+            self.stdout.write(
+                f"{label:>15} {elapsed * 1000:>8.2f}ms {size / 1024:>8.1f}KB "
+                f"{size / baseline:>8.0%}"
+            )
+
+    def encode(self, image, pil_format, save_options):
+        output = BytesIO()
+        image.save(output, format=pil_format, **save_options)
+        return output.tell()
+
+    def load_templates(self, options):
+        if options["templates"]:
+            images = []
+            for path in options["templates"]:
+                image = convert_to_rgb(Image.open(path))
+                image.load()
+                images.append(image)
+            return images
+
+        with open(options["data"]) as f:
+            urls = sorted({meme["image_url"] for meme in json.load(f)})
+        images = []
+        for url in urls:
+            try:
+                images.append(load_base_image(url))
+            except Exception as e:
+                self.stderr.write(f"skipping {url}: {e}")
+        return images
@@ -0,0 +1,122 @@
+"""
+Benchmark caption sizing against the original shrink-by-10% loop.
+
+    uv run python manage.py bench_font_size
+"""
+
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from memes.fonts import font_registry
+from memes.utils import MIN_FONT_SIZE, calculate_font_size, load_impact_font
+
+# A spread of common meme template sizes
+DEFAULT_SIZES = ["600x338", "500x500", "600x600", "800x600", "1200x900", "1920x1080"]
+
+
+def linear_font_size(text, image_width, image_height):
+    """The original algorithm: start big and shrink by 10% until it fits."""
+    if not text:
+        return 40
+
+    max_font_size = min(image_width // 2, image_height // 3)
+    if font_registry.path is None:
+        max_font_size = 40
+
+    margin = image_width * 0.1
+    available_width = image_width - (2 * margin)
+
+    font_size = max_font_size
+    while font_size > MIN_FONT_SIZE:
+        bbox = load_impact_font(font_size).getbbox(text.upper())
+        if bbox[2] - bbox[0] <= available_width:
+            return font_size
+        font_size = int(font_size * 0.9)
+
+    return max(font_size, MIN_FONT_SIZE)
+
+
+class Command(BaseCommand):
+    help = "Compare calculate_font_size with the original linear shrink loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data",
+            default=str(settings.BASE_DIR.parent / "frontend" / "test-data.json"),
+            help="JSON file of memes to take captions from",
+        )
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            default=DEFAULT_SIZES,
+            help="Image sizes to fit captions to, as WIDTHxHEIGHT",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--warm",
+            action="store_true",
+            help="Keep the font cache between calls, rather than measuring cold",
+        )
+
+    def handle(self, *args, **options):
+        with open(options["data"]) as f:
+            memes = json.load(f)
+        captions = sorted(
+            {m[key] for m in memes for key in ("top_text", "bottom_text") if m[key]}
+        )
+        sizes = [tuple(int(n) for n in size.split("x")) for size in options["sizes"]]
+        cases = [(text, w, h) for text in captions for w, h in sizes]
+
+        self.stdout.write(
+            f"{len(captions)} captions x {len(sizes)} image sizes = {len(cases)} cases"
+        )
+
+        results = {}
+        for name, func in [
+            ("linear", linear_font_size),
+            ("predicted", calculate_font_size),
+        ]:
+            elapsed, loads, answers = self.run(func, cases, options)
+            results[name] = answers
+            self.stdout.write(
+                f"{name:>10}: {elapsed * 1000 / len(cases):7.3f}ms per caption, "
+                f"{loads / len(cases):5.1f} font loads per caption"
+            )
+            results[f"{name}_elapsed"] = elapsed
+
+        speedup = results["linear_elapsed"] / results["predicted_elapsed"]
+        self.stdout.write(f"speedup: {speedup:.1f}x")
+
+        diffs = [
+            (case, old, new)
+            for case, old, new in zip(cases, results["linear"], results["predicted"])
+            if old != new
+        ]
+        self.stdout.write(f"{len(diffs)}/{len(cases)} cases chose a different size")
+        if diffs:
+            deltas = [new - old for _, old, new in diffs]
+            self.stdout.write(
+                f"size change: min {min(deltas):+d}, max {max(deltas):+d}, "
+                f"mean {sum(deltas) / len(deltas):+.1f}"
+            )
+            for (text, w, h), old, new in diffs[:10]:
+                self.stdout.write(f"  {w}x{h} {text[:40]!r}: {old} -> {new}")
+
+    def run(self, func, cases, options):
+        answers = []
+        loads = 0
+        elapsed = 0.0
+        for _ in range(options["repeat"]):
+            answers = []
+            for text, width, height in cases:
+                if not options["warm"]:
+                    font_registry.fonts.clear()
+                misses = font_registry.fonts.misses
+                start = time.perf_counter()
+                answers.append(func(text, width, height))
+                elapsed += time.perf_counter() - start
+                loads += font_registry.fonts.misses - misses
+        return elapsed, loads / options["repeat"], answers
@@ -0,0 +1,139 @@
+"""
+Benchmark paging through /api/memes/ by cursor against by OFFSET.
+
+    uv run python manage.py bench_list
+    uv run python manage.py bench_list --rows 100000 --repeat 50
+
+Seeds a fresh database in a temporary directory with --rows memes, then times
+fetching a page at increasing depths. OFFSET has to step over every meme
+before the page, so it gets slower the deeper you go; a cursor seeks straight
+to it, so it shouldn't.
+"""
+
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from memes.models import Meme
+from memes.views import LIST_FIELDS, encode_cursor, list_memes, memes_after
+
+# memes are spread over this many source images, for the image_url filter
+IMAGE_URLS = 100
+SEED_BATCH_SIZE = 10_000
+
+
+def seed(rows):
+    """Insert rows memes, a second apart, with pairs sharing a created_at."""
+    columns = [
+        "id",
+        "image_url",
+        "top_text",
+        "bottom_text",
+        "generated_image",
+        "format",
+        "content_hash",
+        "status",
+        "error",
+        "created_at",
+    ]
+    sql = (
+        f"INSERT INTO {Meme._meta.db_table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    start = datetime(2025, 1, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for batch_start in range(0, rows, SEED_BATCH_SIZE):
+            batch = []
+            for i in range(batch_start, min(batch_start + SEED_BATCH_SIZE, rows)):
+                meme_id = uuid.uuid4().hex
+                batch.append(
+                    (
+                        meme_id,
+                        f"https://example.com/template-{i % IMAGE_URLS}.png",
+                        f"MEME NUMBER {i}",
+                        "ONE DOES NOT SIMPLY PAGE",
+                        f"memes/{meme_id}.png",
+                        "png",
+                        meme_id * 2,
+                        "ready",
+                        "",
+                        (start + timedelta(seconds=i // 2)).isoformat(" "),
+                    )
+                )
+            cursor.executemany(sql, batch)
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare page latency for cursor and OFFSET pagination at increasing depths"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        limit = settings.MEMES_LIST_PAGE_SIZE
+        factory = RequestFactory()
+
+        with tempfile.TemporaryDirectory() as directory:
+            connection.close()
+            connection.settings_dict["NAME"] = str(Path(directory) / "bench.sqlite3")
+            call_command("migrate", verbosity=0)
+
+            start = time.perf_counter()
+            seed(rows)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.stdout.write(
+                f"seeded {rows} memes in {time.perf_counter() - start:.1f}s\n"
+                f"{'depth':>9} {'offset':>10} {'cursor':>10} {'view':>10} "
+                f"{'filtered':>10}"
+            )
+
+            newest = Meme.objects.only(*LIST_FIELDS).order_by("-created_at", "-id")
+            image_url = "https://example.com/template-7.png"
+            filtered = newest.filter(image_url=image_url)
+            depths = [0, 1_000, 10_000, 100_000, rows // 2, rows - limit - 1]
+            for depth in sorted({d for d in depths if 0 <= d < rows}):
+                # the meme just before the page, which is where a cursor from
+                # the previous page would point
+                cursor = encode_cursor(newest[depth])
+                filtered_cursor = encode_cursor(
+                    filtered[min(depth // IMAGE_URLS, rows // IMAGE_URLS - 1)]
+                )
+
+                offset_ms = best_time(
+                    lambda: list(newest[depth + 1 : depth + 1 + limit]), repeat
+                )
+                cursor_ms = best_time(
+                    lambda: list(memes_after(newest, cursor)[:limit]), repeat
+                )
+                request = factory.get("/api/memes/", {"cursor": cursor})
+                view_ms = best_time(lambda: list_memes(request), repeat)
+                filtered_request = factory.get(
+                    "/api/memes/", {"cursor": filtered_cursor, "image_url": image_url}
+                )
+                filtered_ms = best_time(lambda: list_memes(filtered_request), repeat)
+                self.stdout.write(
+                    f"{depth:>9} {offset_ms:>8.2f}ms {cursor_ms:>8.2f}ms "
+                    f"{view_ms:>8.2f}ms {filtered_ms:>8.2f}ms"
+                )
+            connection.close()
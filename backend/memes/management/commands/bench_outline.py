@@ -0,0 +1,103 @@
+"""
+Benchmark the caption outline renderers, and check they draw the same thing.
+
+    uv run python manage.py bench_outline
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageChops, ImageDraw
+
+from memes.utils import OUTLINE_RENDERERS, draw_text_with_outline, load_impact_font
+
+DEFAULT_FONT_SIZES = [20, 40, 80, 120, 160, 200, 300]
+
+
+def render(renderer, text, font_size):
+    """Draw an outlined caption on a grey canvas, like generate_meme does."""
+    font = load_impact_font(font_size)
+    outline_width = max(font_size // 20, 3)
+    bbox = font.getbbox(text)
+    padding = outline_width * 2
+    size = (bbox[2] + padding * 2, bbox[3] + padding * 2)
+    image = Image.new("RGB", size, (128, 128, 128))
+    draw = ImageDraw.Draw(image)
+    draw_text_with_outline(
+        draw,
+        text,
+        (padding, padding),
+        font,
+        outline_width=outline_width,
+        renderer=renderer,
+    )
+    return image
+
+
+def pixel_diff(a, b, threshold):
+    """Fraction of pixels where any channel differs by more than threshold."""
+    diff = ImageChops.difference(a, b).convert("L")
+    histogram = diff.histogram()
+    changed = sum(histogram[threshold + 1 :])
+    return changed / (a.width * a.height)
+
+
+class Command(BaseCommand):
+    help = "Time the outline renderers over a range of font sizes and diff their output"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--text", default="SPANS EVERYWHERE")
+        parser.add_argument(
+            "--font-sizes", nargs="+", type=int, default=DEFAULT_FONT_SIZES
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--threshold",
+            type=int,
+            default=64,
+            help="Per-pixel difference (0-255) below which pixels count as equal",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=2.0,
+            help="Fail if more than this percentage of pixels differ",
+        )
+
+    def handle(self, *args, **options):
+        text = options["text"].upper()
+        renderers = list(OUTLINE_RENDERERS)
+        self.stdout.write(
+            f"{'size':>5} "
+            + " ".join(f"{name:>10}" for name in renderers)
+            + f" {'speedup':>8} {'diff':>7}"
+        )
+
+        failures = []
+        for font_size in options["font_sizes"]:
+            timings = {}
+            images = {}
+            for renderer in renderers:
+                # load the font outside of the timing
+                images[renderer] = render(renderer, text, font_size)
+                start = time.perf_counter()
+                for _ in range(options["repeat"]):
+                    render(renderer, text, font_size)
+                timings[renderer] = (time.perf_counter() - start) / options["repeat"]
+
+            diff = pixel_diff(images["legacy"], images["stroke"], options["threshold"])
+            if diff * 100 > options["tolerance"]:
+                failures.append(font_size)
+
+            self.stdout.write(
+                f"{font_size:>5} "
+                + " ".join(f"{timings[name] * 1000:>8.2f}ms" for name in renderers)
+                + f" {timings['legacy'] / timings['stroke']:>7.1f}x"
+                + f" {diff * 100:>6.2f}%"
+            )
+
+        if failures:
+            raise CommandError(
+                f"stroke output differs from legacy by more than "
+                f"{options['tolerance']}% at font sizes {failures}"
+            )
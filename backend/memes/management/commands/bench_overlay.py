@@ -0,0 +1,105 @@
+"""
+Benchmark drawing captions directly against compositing cached overlays.
+
+    uv run python manage.py bench_overlay
+"""
+
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from memes.management.commands.bench_outline import pixel_diff
+from memes.utils import (
+    calculate_layout,
+    convert_to_rgb,
+    draw_text_with_outline,
+    get_caption_overlay,
+    load_impact_font,
+    overlays,
+    paste_caption_overlay,
+)
+
+
+def draw_captions(image, layout):
+    draw = ImageDraw.Draw(image)
+    font = load_impact_font(layout.font_size)
+    for caption in layout.captions:
+        draw_text_with_outline(
+            draw,
+            caption.text,
+            (caption.x, caption.y),
+            font,
+            outline_width=layout.outline_width,
+        )
+
+
+def paste_overlays(image, layout):
+    for caption in layout.captions:
+        overlay = get_caption_overlay(
+            caption.text, layout.font_size, layout.outline_width
+        )
+        paste_caption_overlay(image, overlay, (caption.x, caption.y))
+
+
+class Command(BaseCommand):
+    help = "Compare drawing captions with cold and cached caption overlays"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data",
+            default=str(settings.BASE_DIR.parent / "frontend" / "test-data.json"),
+            help="JSON file of memes to take captions from",
+        )
+        parser.add_argument(
+            "--template",
+            default=os.path.join(settings.MEDIA_ROOT, "memes", "meme.png"),
+            help="Image to draw the captions on",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with open(options["data"]) as f:
+            memes = json.load(f)
+        template = convert_to_rgb(Image.open(options["template"]))
+        template.load()
+        layouts = [
+            calculate_layout(m["top_text"], m["bottom_text"], *template.size)
+            for m in memes
+        ]
+        self.stdout.write(
+            f"{len(layouts)} caption pairs on a {template.width}x{template.height} template"
+        )
+
+        timings = {"draw": 0.0, "cold overlay": 0.0, "cached overlay": 0.0}
+        worst_diff = 0.0
+        for _ in range(options["repeat"]):
+            for layout in layouts:
+                drawn = template.copy()
+                start = time.perf_counter()
+                draw_captions(drawn, layout)
+                timings["draw"] += time.perf_counter() - start
+
+                overlays.clear()
+                cold = template.copy()
+                start = time.perf_counter()
+                paste_overlays(cold, layout)
+                timings["cold overlay"] += time.perf_counter() - start
+
+                cached = template.copy()
+                start = time.perf_counter()
+                paste_overlays(cached, layout)
+                timings["cached overlay"] += time.perf_counter() - start
+
+                worst_diff = max(worst_diff, pixel_diff(drawn, cached, 32))
+
+        renders = len(layouts) * options["repeat"]
+        for name, elapsed in timings.items():
+            self.stdout.write(
+                f"{name:>15}: {elapsed * 1000 / renders:7.3f}ms per meme "
+                f"({timings['draw'] / elapsed:.1f}x vs draw)"
+            )
+        self.stdout.write(f"worst pixel difference from drawing: {worst_diff:.3%}")
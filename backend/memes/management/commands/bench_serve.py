@@ -0,0 +1,78 @@
+"""
+Benchmark serve_meme, finding images by database lookup against by id alone.
+
+    uv run python manage.py bench_serve
+    uv run python manage.py bench_serve --count 200 --repeat 5
+
+Uses memes already in the database, so create some (or run the frontend load
+test) and migrate_meme_files first.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from memes.models import Meme
+from memes.views import (
+    find_meme_image,
+    find_meme_image_in_db,
+    image_response,
+    meme_etag,
+    serve_meme,
+)
+
+
+def serve_with(find):
+    """A cut down serve_meme that finds the image with find."""
+
+    def serve(request, meme_id):
+        name, _, _ = find(meme_id)
+        return image_response(request, name, meme_etag(meme_id))
+
+    return serve
+
+
+class Command(BaseCommand):
+    help = "Compare requests per second for serve_meme with and without the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        ids = list(Meme.objects.values_list("id", flat=True)[: options["count"]])
+        if not ids:
+            raise CommandError("No memes to serve, create some first")
+        # the id path can't serve the rest, so leave them out of all three
+        migrated = [meme_id for meme_id in ids if find_meme_image(meme_id) is not None]
+        if len(migrated) < len(ids):
+            self.stderr.write(
+                f"Skipping {len(ids) - len(migrated)} of {len(ids)} memes that "
+                f"aren't in the id layout, run migrate_meme_files to include them"
+            )
+        if not migrated:
+            raise CommandError("No memes in the id layout to serve")
+        ids = migrated
+
+        views = {
+            "database": serve_with(find_meme_image_in_db),
+            "id path": serve_with(find_meme_image),
+            "serve_meme": serve_meme,
+        }
+        factory = RequestFactory()
+        requests = [(factory.get(f"/images/{meme_id}/"), meme_id) for meme_id in ids]
+        baseline = None
+        for label, view in views.items():
+            start = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for request, meme_id in requests:
+                    response = view(request, meme_id)
+                    for _ in response:
+                        pass
+                    response.close()
+            rate = len(requests) * options["repeat"] / (time.perf_counter() - start)
+            baseline = baseline or rate
+            self.stdout.write(
+                f"{label:>10}: {rate:8.0f} req/s ({rate / baseline:.2f}x)"
+            )
@@ -0,0 +1,64 @@
+"""
+Move meme images from the old flat memes/ directory to the id-derived layout.
+
+    uv run python manage.py migrate_meme_files --dry-run
+    uv run python manage.py migrate_meme_files
+
+serve_meme falls back to the database for images it can't find by id, so this
+can be run while the server is up.
+"""
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from memes.models import Meme, meme_image_name
+from memes.utils import OUTPUT_FORMATS
+from memes.views import link_image
+
+
+class Command(BaseCommand):
+    help = "Move meme images to paths derived from their meme's id"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be moved, without changing anything",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        moved = missing = 0
+        # deduplicated memes share an image, so only remove old files once
+        # every meme using them has its own link
+        old_names = set()
+
+        memes = Meme.objects.only("id", "format", "generated_image")
+        for meme in memes.iterator():
+            old = meme.generated_image.name
+            new = meme_image_name(meme.id, OUTPUT_FORMATS[meme.format].extension)
+            if not old or old == new:
+                continue
+            if not default_storage.exists(old):
+                missing += 1
+                self.stderr.write(f"{meme.id}: {old} is missing, skipping")
+                continue
+
+            moved += 1
+            if dry_run:
+                self.stdout.write(f"{old} -> {new}")
+                continue
+            link_image(old, new)
+            Meme.objects.filter(id=meme.id).update(generated_image=new)
+            old_names.add(old)
+
+        for old in old_names:
+            # something may have started using it again since we looked
+            if not Meme.objects.filter(generated_image=old).exists():
+                default_storage.delete(old)
+
+        action = "would move" if dry_run else "moved"
+        self.stdout.write(
+            f"{action} {moved} images, removed {len(old_names)} old files, "
+            f"{missing} missing"
+        )
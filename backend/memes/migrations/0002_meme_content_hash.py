@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
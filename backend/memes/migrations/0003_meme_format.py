@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0002_meme_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="format",
+            field=models.CharField(default="png", max_length=8),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:31
+
+import memes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0003_meme_format"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="meme",
+            name="generated_image",
+            field=models.ImageField(upload_to=memes.models.meme_upload_to),
+        ),
+    ]
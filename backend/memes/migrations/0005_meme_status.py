@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:37
+
+import memes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0004_meme_image_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="meme",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("rendering", "Rendering"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                default="ready",
+                max_length=16,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="meme",
+            name="generated_image",
+            field=models.ImageField(blank=True, upload_to=memes.models.meme_upload_to),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0005_meme_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="meme",
+            index=models.Index(fields=["-created_at", "-id"], name="meme_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="meme",
+            index=models.Index(
+                fields=["image_url", "-created_at", "-id"],
+                name="meme_image_url_created_idx",
+            ),
+        ),
+    ]
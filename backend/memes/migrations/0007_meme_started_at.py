@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("memes", "0006_meme_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
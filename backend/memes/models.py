@@ -4,14 +4,68 @@ from django.db import models
 from django.urls import reverse
 
 
+def meme_image_name(meme_id, extension):
+    """Where a meme's image is stored, which we can work out from its id alone.
+
+    The first two pairs of hex digits are used as directories, so no one
+    directory gets too big.
+    """
+    meme_id = str(meme_id)
+    return f"memes/{meme_id[:2]}/{meme_id[2:4]}/{meme_id}.{extension}"
+
+
+def meme_derivative_name(image_name, width, extension):
+    """Where a copy of a meme's image scaled down to width is stored, next to it."""
+    stem, _ = os.path.splitext(image_name)
+    return f"{stem}.w{width}.{extension}"
+
+
+def meme_upload_to(instance, filename):
+    extension = os.path.splitext(filename)[1].lstrip(".") or instance.format
+    return meme_image_name(instance.id, extension)
+
+
 class Meme(models.Model):
+    class Status(models.TextChoices):
+        # created in job mode, waiting for a job thread to pick it up
+        PENDING = "pending"
+        RENDERING = "rendering"
+        READY = "ready"
+        FAILED = "failed"
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     image_url = models.URLField()
     top_text = models.CharField(max_length=255, blank=True)
     bottom_text = models.CharField(max_length=255, blank=True)
-    generated_image = models.ImageField(upload_to="memes/")
+    # empty until a pending meme has been rendered
+    generated_image = models.ImageField(upload_to=meme_upload_to, blank=True)
+    # one of memes.utils.OUTPUT_FORMATS
+    format = models.CharField(max_length=8, default="png")
+    # sha256 of the inputs and render settings, used to reuse identical memes
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.READY
+    )
+    # why rendering failed, for failed memes
+    error = models.TextField(blank=True)
+    # when a job claimed it to render, for memes created in job mode
+    started_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # list_memes pages through memes newest first, by (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="meme_created_idx"),
+            models.Index(
+                fields=["image_url", "-created_at", "-id"],
+                name="meme_image_url_created_idx",
+            ),
+        ]
+
+    @property
+    def is_pending(self):
+        return self.status in (self.Status.PENDING, self.Status.RENDERING)
+
     def get_image_url(self):
         # Generate relative URL
         relative_url = reverse("memes:serve_meme", kwargs={"meme_id": self.id})
@@ -0,0 +1,478 @@
+"""
+Two-tier cache for the source images that memes are drawn on.
+
+Most memes reuse a small set of template images, so we keep recently used
+image bytes in memory, and what we fetch on disk under MEDIA_ROOT, each tier
+with its own byte budget. We follow the origin's Cache-Control/Expires headers
+for freshness, and use ETag/Last-Modified to make conditional requests once an
+entry goes stale.
+
+Source images are streamed rather than read in one go, so we can give up on
+anything too big from its Content-Length, or from the dimensions in its image
+header, before we've read (and held in memory) the whole body.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from email.utils import parsedate_to_datetime
+from functools import cached_property
+
+from django.conf import settings
+from opentelemetry import trace
+from PIL import Image, UnidentifiedImageError
+
+from client import async_httpx_client, httpx_client
+from memes.cache import LRUCache, register
+
+# Cap on the heuristic freshness we give responses with only a Last-Modified
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+# Give up on finding an image header after this many bytes
+MAX_SNIFF_BYTES = 256 * 1024
+# When the disk tier goes over its budget, prune it down to this much of it, so
+# we aren't pruning again on the very next write
+DISK_PRUNE_TARGET = 0.9
+
+
+class SourceImageError(Exception):
+    """Raised when a source image isn't one we can draw a meme on."""
+
+
+class SourceImageTooLargeError(SourceImageError):
+    """Raised when a source image is bigger than we're willing to download."""
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into a dict of lower case directives."""
+    directives = {}
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+def parse_http_date(value):
+    """Parse an HTTP date header into a timestamp, or None if it's invalid."""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers, now):
+    """How many seconds a response can be used without revalidating it."""
+    cache_control = parse_cache_control(headers.get("cache-control", ""))
+    if "no-cache" in cache_control:
+        return 0
+
+    date = parse_http_date(headers.get("date", "")) or now
+    if "max-age" in cache_control:
+        try:
+            lifetime = int(cache_control["max-age"])
+        except ValueError:
+            return 0
+    elif "expires" in headers:
+        expires = parse_http_date(headers["expires"])
+        lifetime = expires - date if expires else 0
+    elif "last-modified" in headers:
+        # RFC 9111 heuristic: 10% of the time since it was last modified
+        last_modified = parse_http_date(headers["last-modified"]) or date
+        lifetime = min((date - last_modified) / 10, MAX_HEURISTIC_LIFETIME)
+    else:
+        return 0
+
+    try:
+        age = int(headers.get("age", 0))
+    except ValueError:
+        age = 0
+    return max(lifetime - age, 0)
+
+
+@dataclass
+class SourceImage:
+    """The bytes of a fetched source image and what we need to revalidate it."""
+
+    url: str
+    content: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    # timestamp after which we need to revalidate with the origin
+    expires: float = 0
+
+    @classmethod
+    def from_response(cls, url, response, content, now):
+        return cls(
+            url=url,
+            content=content,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            expires=now + freshness_lifetime(response.headers, now),
+        )
+
+    @property
+    def validator(self):
+        """Something that changes whenever the image does."""
+        return self.etag or self.last_modified or self.digest
+
+    @cached_property
+    def digest(self):
+        return hashlib.sha256(self.content).hexdigest()
+
+    def is_fresh(self, now):
+        return now < self.expires
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def revalidated(self, response, now):
+        """A copy of this entry updated from a 304 Not Modified response."""
+        return SourceImage(
+            url=self.url,
+            content=self.content,
+            etag=response.headers.get("etag", self.etag),
+            last_modified=response.headers.get("last-modified", self.last_modified),
+            expires=now + freshness_lifetime(response.headers, now),
+        )
+
+    def metadata(self):
+        metadata = asdict(self)
+        del metadata["content"]
+        return metadata
+
+
+class CappedDownload:
+    """Collects a streamed image body, giving up as soon as it's too big.
+
+    As chunks arrive we try to open what we have so far with Pillow, which
+    only reads the image header, so we know the format and dimensions long
+    before the last byte, and without allocating the image itself.
+    """
+
+    def __init__(self, url, max_bytes, max_pixels):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.chunks = []
+        self.size = 0
+        self.format = None
+        self.dimensions = None
+
+    def check_headers(self, headers):
+        length = headers.get("content-length", "")
+        if length.isdigit() and int(length) > self.max_bytes:
+            self.abort(f"{length} bytes is more than the limit of {self.max_bytes}")
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.abort(f"more than the limit of {self.max_bytes} bytes")
+        self.chunks.append(chunk)
+
+        if self.dimensions is None and not self.sniff():
+            if self.size > MAX_SNIFF_BYTES:
+                self.reject(f"no image header in the first {MAX_SNIFF_BYTES} bytes")
+
+    def sniff(self):
+        """Read the image header if we have it, and check its dimensions."""
+        try:
+            with Image.open(io.BytesIO(self.content)) as image:
+                self.format = image.format
+                self.dimensions = image.size
+        except Image.DecompressionBombError as e:
+            # more pixels than even Pillow will open
+            self.abort(str(e))
+        except (UnidentifiedImageError, OSError):
+            # not enough of it yet, or not an image at all
+            return False
+
+        width, height = self.dimensions
+        span = trace.get_current_span()
+        span.set_attribute("source.format", self.format or "")
+        span.set_attribute("source.width", width)
+        span.set_attribute("source.height", height)
+        if width * height > self.max_pixels:
+            self.abort(
+                f"{width}x{height} is more than the limit of {self.max_pixels} pixels"
+            )
+        return True
+
+    def finish(self):
+        """Return the whole body, once it's all been fed in."""
+        if self.dimensions is None and not self.sniff():
+            self.reject("not an image we can read")
+        return self.content
+
+    def abort(self, reason):
+        trace.get_current_span().set_attribute("source.too_large", True)
+        raise SourceImageTooLargeError(
+            f"Source image {self.url} is too large: {reason}"
+        )
+
+    def reject(self, reason):
+        raise SourceImageError(f"Source image {self.url} is invalid: {reason}")
+
+    @property
+    def content(self):
+        return b"".join(self.chunks)
+
+
+class SourceCache:
+    """In-memory LRU bounded in bytes, backed by a directory on disk.
+
+    The directory is bounded too, by max_disk_bytes of image content. Reading
+    an entry bumps its mtime, so pruning drops the least recently used first.
+    """
+
+    def __init__(
+        self,
+        name,
+        directory,
+        max_bytes,
+        max_download_bytes,
+        max_pixels,
+        max_disk_bytes=None,
+        client=httpx_client,
+        async_client=async_httpx_client,
+    ):
+        self.name = name
+        self.directory = directory
+        self.max_download_bytes = max_download_bytes
+        self.max_pixels = max_pixels
+        self.max_disk_bytes = max_disk_bytes
+        # roughly how many bytes of content are on disk, counting our own
+        # writes since we last looked. None until we first look
+        self.disk_bytes = None
+        self.client = client
+        self.async_client = async_client
+        self.memory = LRUCache(
+            f"{name}.memory", max_bytes=max_bytes, sizeof=len_content
+        )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.disk_evictions = 0
+        self._lock = threading.Lock()
+        register(name, self)
+
+    def fetch(self, url):
+        """Return the SourceImage for url, from cache if we can."""
+        entry = self.lookup(url)
+        if entry is not None and entry.is_fresh(time.time()):
+            return entry
+
+        headers = entry.conditional_headers() if entry is not None else {}
+        content = b""
+        # leaving the block early closes the connection, so we stop reading
+        # as soon as we know the image is too large
+        with self.client.stream("GET", url, headers=headers) as response:
+            if self.wants_body(response):
+                download = self.start_download(url, response)
+                for chunk in response.iter_bytes():
+                    download.feed(chunk)
+                content = download.finish()
+        return self.update(url, entry, response, content)
+
+    async def afetch(self, url):
+        """Async version of fetch, for the ASGI request path."""
+        # lookup and update may touch the disk, so keep them off the event loop
+        entry = await asyncio.to_thread(self.lookup, url)
+        if entry is not None and entry.is_fresh(time.time()):
+            return entry
+
+        headers = entry.conditional_headers() if entry is not None else {}
+        content = b""
+        async with self.async_client.stream("GET", url, headers=headers) as response:
+            if self.wants_body(response):
+                download = self.start_download(url, response)
+                async for chunk in response.aiter_bytes():
+                    download.feed(chunk)
+                content = download.finish()
+        return await asyncio.to_thread(self.update, url, entry, response, content)
+
+    def wants_body(self, response):
+        # 304s have no body, and error bodies are no use to us
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        return True
+
+    def start_download(self, url, response):
+        download = CappedDownload(url, self.max_download_bytes, self.max_pixels)
+        download.check_headers(response.headers)
+        return download
+
+    def lookup(self, url):
+        """Find a cached entry for url, counting it as a hit if it's fresh."""
+        tier = "memory"
+        entry = self.memory.get(url)
+        if entry is None:
+            tier = "disk"
+            entry = self.read(url)
+            if entry is not None:
+                self.memory.set(url, entry)
+
+        if entry is not None and entry.is_fresh(time.time()):
+            self._count(f"{tier}_hits")
+            trace.get_current_span().set_attribute("source_cache.result", tier)
+        return entry
+
+    def update(self, url, entry, response, content):
+        """Store the result of fetching or revalidating url, and return the entry."""
+        now = time.time()
+        if response.status_code == 304 and entry is not None:
+            self._count("revalidations")
+            result = "revalidated"
+            entry = entry.revalidated(response, now)
+        else:
+            response.raise_for_status()
+            self._count("misses")
+            result = "miss"
+            entry = SourceImage.from_response(url, response, content, now)
+
+        trace.get_current_span().set_attribute("source_cache.result", result)
+        cache_control = parse_cache_control(response.headers.get("cache-control", ""))
+        if "no-store" in cache_control:
+            self.delete(url)
+            return entry
+
+        self.memory.set(url, entry)
+        self.write(entry, content_changed=result == "miss")
+        return entry
+
+    def path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def read(self, url):
+        if not self.directory:
+            return None
+        path = self.path(url)
+        try:
+            with open(f"{path}.json") as f:
+                metadata = json.load(f)
+            with open(path, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        if metadata.get("url") != url:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return SourceImage(content=content, **metadata)
+
+    def write(self, entry, content_changed=True):
+        if not self.directory:
+            return
+        path = self.path(entry.url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to temporary files and rename, so other workers never see
+        # half-written entries
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if content_changed or not os.path.exists(path):
+            with open(tmp, "wb") as f:
+                f.write(entry.content)
+            os.replace(tmp, path)
+            self._grow_disk(len(entry.content))
+        with open(tmp, "w") as f:
+            json.dump(entry.metadata(), f)
+        os.replace(tmp, f"{path}.json")
+
+    def _grow_disk(self, size):
+        if self.max_disk_bytes is None:
+            return
+        with self._lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += size
+            over = self.disk_bytes is None or self.disk_bytes > self.max_disk_bytes
+        if over:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used entries on disk if it's over budget.
+
+        Other workers write to the same directory, so this is where we find
+        out how much is really there.
+        """
+        entries = []
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                # skip metadata and temporary files, which come and go with
+                # the content
+                if "." in filename:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_disk_bytes:
+            target = self.max_disk_bytes * DISK_PRUNE_TARGET
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                for filename in (path, f"{path}.json"):
+                    try:
+                        os.remove(filename)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                self._count("disk_evictions")
+        with self._lock:
+            self.disk_bytes = total
+
+    def delete(self, url):
+        self.memory.delete(url)
+        if self.directory:
+            for path in (self.path(url), f"{self.path(url)}.json"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "disk_bytes": self.disk_bytes,
+            "disk_evictions": self.disk_evictions,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+def len_content(entry):
+    return len(entry.content)
+
+
+source_cache = SourceCache(
+    "sources",
+    settings.MEMES_SOURCE_CACHE_DIR,
+    settings.MEMES_SOURCE_CACHE_BYTES,
+    settings.MEMES_SOURCE_MAX_BYTES,
+    settings.MEMES_SOURCE_MAX_PIXELS,
+    settings.MEMES_SOURCE_CACHE_DISK_BYTES,
+)
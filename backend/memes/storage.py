@@ -0,0 +1,387 @@
+"""
+Storage for generated meme images.
+
+MEMES_STORAGE picks where images are kept: LocalStorage, under MEDIA_ROOT, or
+S3Storage, in an S3-compatible bucket. With MEMES_STORAGE_WRITE_BEHIND, that
+storage sits behind a WriteBehindStorage, which saves images to a local spool
+directory and returns, and uploads them in the background. Until an image is
+uploaded it's read from the spool, and images left in the spool by a worker
+that died are uploaded by the next worker to start.
+
+Images are named after their meme (see memes.models), so these never rename a
+file to avoid a clash, and have a few extras beyond Django's Storage API:
+copy(), local_path(), and recover() and shutdown() for the spool.
+"""
+
+import fcntl
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import shutil
+import time
+import uuid
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+import httpx
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage, StorageHandler
+from django.utils import timezone
+from opentelemetry import trace
+
+from client import httpx_client
+from memes.jobs import JobQueue
+
+tracer = trace.get_tracer("memes.storage")
+logger = logging.getLogger(__name__)
+
+# images part written to the spool have this suffix until they're complete
+SPOOLING_SUFFIX = ".spooling"
+# and are left by a worker that died if they're this old, in seconds
+SPOOLING_MAX_AGE = 60
+
+
+def link_or_copy(source, target):
+    """Hard link the file at source to target, or copy it if we can't."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        # there's no source to copy either
+        raise
+    except OSError:
+        # e.g. the filesystem doesn't do hard links
+        shutil.copyfile(source, target)
+
+
+class MemeStorage(Storage):
+    """The extras every meme image storage has, with their defaults."""
+
+    def is_name_available(self, name, max_length=None):
+        # overwrite rather than rename, as names come from the meme's id
+        return not (max_length and len(name) > max_length)
+
+    def copy(self, existing, name):
+        """Store the image called existing under name too."""
+        with self.open(existing) as f:
+            self.save(name, f)
+
+    def local_path(self, name):
+        """The path of a local file with this image, for a front proxy to send.
+
+        None if there isn't one.
+        """
+        return None
+
+    def recover(self):
+        """Pick up work a worker that died left unfinished, and say how much."""
+        return 0
+
+    def shutdown(self):
+        pass
+
+
+class LocalStorage(MemeStorage, FileSystemStorage):
+    """Images as files under MEDIA_ROOT."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def copy(self, existing, name):
+        link_or_copy(self.path(existing), self.path(name))
+
+    def local_path(self, name):
+        return self.path(name)
+
+
+class S3Storage(MemeStorage):
+    """Images as objects in an S3-compatible bucket.
+
+    Requests are signed with AWS Signature Version 4, and use path style URLs
+    (endpoint_url/bucket/name), which MinIO, moto and the like all support.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        endpoint_url,
+        access_key_id,
+        secret_access_key,
+        region="us-east-1",
+        client=None,
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.client = client or httpx_client
+
+    def object_path(self, name):
+        return quote(f"/{self.bucket}/{name}", safe="/-_.~")
+
+    def sign(self, method, url, headers, payload_hash):
+        """Add the x-amz-* and Authorization headers for a request."""
+        now = datetime.now(UTC)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        url = httpx.URL(url)
+        headers["host"] = url.netloc.decode()
+        headers["x-amz-date"] = amz_date
+        headers["x-amz-content-sha256"] = payload_hash
+
+        signed_headers = ";".join(sorted(k.lower() for k in headers))
+        canonical_headers = "".join(
+            f"{k.lower()}:{str(v).strip()}\n" for k, v in sorted(headers.items())
+        )
+        canonical_request = "\n".join(
+            [
+                method,
+                url.raw_path.decode(),
+                "",
+                canonical_headers,
+                signed_headers,
+                payload_hash,
+            ]
+        )
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        key = f"AWS4{self.secret_access_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+
+    def request(self, method, name, content=b"", headers=None):
+        """Make a signed request for the object called name.
+
+        Raises FileNotFoundError if there's no such object, and
+        httpx.HTTPStatusError for other errors.
+        """
+        url = self.endpoint_url + self.object_path(name)
+        headers = self.sign(
+            method, url, dict(headers or {}), hashlib.sha256(content).hexdigest()
+        )
+        response = self.client.request(method, url, content=content, headers=headers)
+        if response.status_code == 404:
+            raise FileNotFoundError(name)
+        response.raise_for_status()
+        return response
+
+    def _save(self, name, content):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        body = b"".join(content.chunks())
+        self.request("PUT", name, body, {"content-type": content_type})
+        return name
+
+    def _open(self, name, mode="rb"):
+        # meme images are small enough to just read in one go
+        return ContentFile(self.request("GET", name).content, name=name)
+
+    def copy(self, existing, name):
+        # copied by the server, without downloading it
+        self.request(
+            "PUT", name, headers={"x-amz-copy-source": self.object_path(existing)}
+        )
+
+    def exists(self, name):
+        try:
+            self.request("HEAD", name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        self.request("DELETE", name)
+
+    def size(self, name):
+        return int(self.request("HEAD", name).headers["content-length"])
+
+    def get_modified_time(self, name):
+        modified = parsedate_to_datetime(
+            self.request("HEAD", name).headers["last-modified"]
+        )
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def url(self, name):
+        return self.endpoint_url + self.object_path(name)
+
+
+class SpooledFile(File):
+    """A spooled image being uploaded.
+
+    It has a temporary_file_path() like an upload, so LocalStorage moves it
+    into place rather than copying it.
+    """
+
+    def __init__(self, file, path):
+        super().__init__(file, name=path)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def same_file(f, path):
+    """Whether path is still the file f has open."""
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+class WriteBehindStorage(MemeStorage):
+    """Saves to a local spool, and uploads to another storage in the background.
+
+    backend is a STORAGES style dict for the storage to upload to. The spool
+    is shared by every worker on the host, so images are readable by all of
+    them as soon as they're saved, and one worker's uploads can be finished by
+    another.
+    """
+
+    def __init__(self, backend, spool_dir, upload_workers=4, upload_retries=3):
+        self.backend = StorageHandler().create_storage(backend)
+        self.spool_dir = str(spool_dir)
+        self.upload_retries = upload_retries
+        self.uploads = JobQueue("uploads", upload_workers)
+
+    def spool_path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    def _save(self, name, content):
+        path = self.spool_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write it to one side, so the spool only ever has complete images
+        partial = f"{path}.{uuid.uuid4().hex}{SPOOLING_SUFFIX}"
+        with open(partial, "xb") as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        os.replace(partial, path)
+        self.uploads.submit(self.upload, name)
+        return name
+
+    def upload(self, name):
+        """Upload a spooled image to the backend, and remove it from the spool."""
+        path = self.spool_path(name)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # it's already been uploaded
+            return
+        with f:
+            # wait for anyone else uploading it (e.g. another worker's
+            # recover()), or another name hard linked to it
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # it may have been uploaded and removed while we waited
+            if not same_file(f, path):
+                return
+            with tracer.start_as_current_span("upload_meme_image") as span:
+                span.set_attribute("storage.name", name)
+                for attempt in range(self.upload_retries + 1):
+                    span.set_attribute("storage.attempts", attempt + 1)
+                    try:
+                        self.backend.save(name, SpooledFile(f, path))
+                        break
+                    except Exception as e:
+                        span.record_exception(e)
+                        if attempt == self.upload_retries:
+                            # it stays in the spool, for the next worker to start
+                            logger.warning(f"Could not upload {name}: {e}")
+                            raise
+                        time.sleep(2**attempt)
+                        f.seek(0)
+            # LocalStorage moves it rather than copying it
+            if same_file(f, path):
+                os.remove(path)
+
+    def recover(self):
+        """Queue uploads for images left in the spool, and return how many."""
+        count = 0
+        for directory, _, filenames in os.walk(self.spool_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.endswith(SPOOLING_SUFFIX):
+                    # half written by a worker that died, so the meme was
+                    # never saved, unless another worker is still writing it
+                    try:
+                        if time.time() - os.path.getmtime(path) > SPOOLING_MAX_AGE:
+                            os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                name = os.path.relpath(path, self.spool_dir).replace(os.sep, "/")
+                self.uploads.submit(self.upload, name)
+                count += 1
+        return count
+
+    def shutdown(self):
+        # anything not uploaded yet stays in the spool for recover()
+        self.uploads.shutdown()
+
+    def _open(self, name, mode="rb"):
+        try:
+            return File(open(self.spool_path(name), mode))
+        except FileNotFoundError:
+            return self.backend.open(name, mode)
+
+    def copy(self, existing, name):
+        try:
+            link_or_copy(self.spool_path(existing), self.spool_path(name))
+        except FileNotFoundError:
+            self.backend.copy(existing, name)
+        else:
+            self.uploads.submit(self.upload, name)
+
+    def local_path(self, name):
+        path = self.spool_path(name)
+        if os.path.exists(path):
+            return path
+        return self.backend.local_path(name)
+
+    def exists(self, name):
+        return os.path.exists(self.spool_path(name)) or self.backend.exists(name)
+
+    def delete(self, name):
+        try:
+            os.remove(self.spool_path(name))
+        except FileNotFoundError:
+            pass
+        self.backend.delete(name)
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self.spool_path(name))
+        except FileNotFoundError:
+            return self.backend.size(name)
+
+    def get_modified_time(self, name):
+        try:
+            modified = os.path.getmtime(self.spool_path(name))
+        except FileNotFoundError:
+            return self.backend.get_modified_time(name)
+        return datetime.fromtimestamp(modified, tz=UTC if settings.USE_TZ else None)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def url(self, name):
+        return self.backend.url(name)
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.fixture
+def local_storage(settings, tmp_path):
+    """Keep meme images in tmp_path, with no write-behind spool."""
+    settings.MEDIA_ROOT = tmp_path
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "default": {
+            "BACKEND": "memes.storage.LocalStorage",
+            "OPTIONS": {"location": tmp_path},
+        },
+    }
+    return tmp_path
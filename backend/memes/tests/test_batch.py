@@ -0,0 +1,199 @@
+import asyncio
+import io
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from django.test import RequestFactory
+from PIL import Image
+
+from memes import views
+from memes.executor import RenderExecutor, RenderQueueFullError, render_executor
+from memes.models import Meme
+from memes.sources import source_cache
+
+
+def png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "blue").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def origin(request):
+    return httpx.Response(200, headers={"cache-control": "max-age=3600"}, content=png())
+
+
+@pytest.fixture(autouse=True)
+def stubbed(local_storage, settings, monkeypatch):
+    """A stub origin, and rendering in process."""
+    settings.MEMES_RENDER_RETRY_AFTER = 0
+    transport = httpx.MockTransport(origin)
+    monkeypatch.setattr(source_cache, "client", httpx.Client(transport=transport))
+    monkeypatch.setattr(
+        source_cache, "async_client", httpx.AsyncClient(transport=transport)
+    )
+    monkeypatch.setattr(source_cache, "directory", None)
+    monkeypatch.setattr(render_executor, "max_workers", 0)
+
+
+SPECS = [
+    {"image_url": "https://example.com/a.png", "top_text": "ONE", "format": "png"},
+    {"image_url": "https://example.com/a.png", "top_text": "ONE", "format": "png"},
+    {"image_url": "https://example.com/a.png", "top_text": "TWO", "format": "png"},
+    {"image_url": "https://example.com/b.png", "top_text": "THREE", "format": "png"},
+    {"top_text": "NO IMAGE"},
+]
+
+
+def batch_request():
+    return RequestFactory().post(
+        "/api/create/batch/",
+        json.dumps({"memes": SPECS}),
+        content_type="application/json",
+    )
+
+
+def check_lines(lines):
+    by_index = {line["index"]: line for line in lines if "index" in line}
+    assert sorted(by_index) == list(range(len(SPECS)))
+    assert "error" in by_index[4]
+    assert lines[-1] == {"status": "complete", "created": 4, "failed": 1}
+    ids = [by_index[i]["id"] for i in range(4)]
+    assert Meme.objects.filter(id__in=ids).count() == 4
+
+
+@pytest.mark.django_db
+def test_ids_are_only_sent_once_saved():
+    response = views.create_memes(batch_request())
+    lines = []
+    for chunk in response.streaming_content:
+        line = json.loads(chunk)
+        if "id" in line:
+            # a client could fetch it as soon as it sees this
+            assert Meme.objects.filter(id=line["id"]).exists()
+        lines.append(line)
+    check_lines(lines)
+
+
+@pytest.mark.django_db
+def test_full_render_queue_is_retried(monkeypatch):
+    run = render_executor.run
+    calls = []
+
+    def busy_once(func, *args):
+        calls.append(func)
+        if len(calls) == 1:
+            raise RenderQueueFullError("busy")
+        return run(func, *args)
+
+    monkeypatch.setattr(render_executor, "run", busy_once)
+    response = views.create_memes(batch_request())
+    check_lines([json.loads(chunk) for chunk in response.streaming_content])
+    # two source images, one of them retried
+    assert len(calls) == 3
+
+
+@pytest.mark.django_db
+def test_full_render_queue_gives_up(settings, monkeypatch):
+    settings.MEMES_BATCH_RETRIES = 1
+
+    def busy(func, *args):
+        raise RenderQueueFullError("busy")
+
+    monkeypatch.setattr(render_executor, "run", busy)
+    response = views.create_memes(batch_request())
+    lines = [json.loads(chunk) for chunk in response.streaming_content]
+    assert all("Server busy" in line["error"] for line in lines[1:-1])
+    assert lines[-1] == {"status": "complete", "created": 0, "failed": 5}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_batch_streams(settings):
+    settings.MEMES_ASYNC = True
+    response = views.create_memes(batch_request())
+    assert response.is_async
+
+    async def collect():
+        return [json.loads(chunk) async for chunk in response.streaming_content]
+
+    check_lines(asyncio.run(collect()))
+
+
+@pytest.mark.django_db
+def test_invalid_fields_only_fail_their_item():
+    specs = [
+        {"image_url": "https://example.com/a.png", "top_text": 1},
+        "https://example.com/a.png",
+        {"image_url": "https://example.com/a.png", "top_text": "FINE", "format": "png"},
+    ]
+    request = RequestFactory().post(
+        "/api/create/batch/",
+        json.dumps({"memes": specs}),
+        content_type="application/json",
+    )
+    response = views.create_memes(request)
+    lines = [json.loads(chunk) for chunk in response.streaming_content]
+    assert lines[:2] == [
+        {"index": 0, "error": "top_text must be a string"},
+        {"index": 1, "error": "Each meme must be a JSON object"},
+    ]
+    assert "id" in lines[2]
+    assert lines[-1] == {"status": "complete", "created": 1, "failed": 2}
+
+
+class FillingUp(dict):
+    """Derivatives the disk fills up partway through saving."""
+
+    def items(self):
+        yield from super().items()
+        raise OSError("disk full")
+
+
+@pytest.mark.django_db
+def test_failed_saves_delete_what_they_wrote(local_storage, monkeypatch):
+    def render_memes(url, validator, content, captions):
+        derivatives = FillingUp({(32, "png"): png()})
+        return [SimpleNamespace(content=png(), derivatives=derivatives)] * len(captions)
+
+    monkeypatch.setattr(views, "render_memes", render_memes)
+    response = views.create_memes(batch_request())
+    lines = [json.loads(chunk) for chunk in response.streaming_content]
+    errors = {line["index"]: line["error"] for line in lines[:-1]}
+    assert all("disk full" in errors[index] for index in range(4))
+    assert lines[-1] == {"status": "complete", "created": 0, "failed": 5}
+    assert [path for path in local_storage.rglob("*") if path.is_file()] == []
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+@pytest.mark.django_db(transaction=True)
+def test_batch_renders_wait_for_the_pool(use_async, settings, monkeypatch):
+    # more chunks than the pool takes at once, and no retrying when it's full
+    settings.MEMES_ASYNC = use_async
+    settings.MEMES_BATCH_CHUNK_SIZE = 1
+    settings.MEMES_BATCH_RETRIES = 0
+    executor = RenderExecutor(max_workers=1, max_queued=0)
+    monkeypatch.setattr(views, "render_executor", executor)
+    specs = [
+        {"image_url": "https://example.com/a.png", "top_text": str(i), "format": "png"}
+        for i in range(6)
+    ]
+    request = RequestFactory().post(
+        "/api/create/batch/",
+        json.dumps({"memes": specs}),
+        content_type="application/json",
+    )
+    try:
+        response = views.create_memes(request)
+        if use_async:
+
+            async def collect():
+                return [json.loads(chunk) async for chunk in response.streaming_content]
+
+            lines = asyncio.run(collect())
+        else:
+            lines = [json.loads(chunk) for chunk in response.streaming_content]
+    finally:
+        executor.shutdown()
+    assert lines[-1] == {"status": "complete", "created": 6, "failed": 0}
+    assert executor.rejected == 0
@@ -0,0 +1,24 @@
+import json
+
+import pytest
+from django.test import Client
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ({"image_url": ["https://example.com/a.png"]}, "image_url must be a string"),
+        ({"image_url": "https://example.com/a.png", "top_text": 1}, "top_text"),
+        ({"image_url": "https://example.com/a.png", "bottom_text": {}}, "bottom_text"),
+        ({"image_url": "https://example.com/a.png", "format": 5}, "format"),
+        ({"image_url": "https://example.com/a.png", "format": "bmp"}, "Unsupported"),
+        (["https://example.com/a.png"], "JSON object"),
+    ],
+)
+@pytest.mark.django_db
+def test_invalid_fields_are_a_bad_request(data, error):
+    response = Client().post(
+        "/api/create/", json.dumps(data), content_type="application/json"
+    )
+    assert response.status_code == 400
+    assert error in response.json()["error"]
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from memes.cache import merge_stats
+from memes.executor import RenderExecutor, RenderQueueFullError
+from memes.fonts import font_registry
+
+
+def load_font(size):
+    font_registry.get(size)
+    return os.getpid()
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def executor():
+    executor = RenderExecutor(max_workers=2, max_queued=0)
+    yield executor
+    executor.shutdown()
+
+
+def test_pool_reports_render_cache_stats(executor):
+    pids = {executor.run(load_font, 40) for _ in range(6)}
+    assert os.getpid() not in pids
+
+    fonts = executor.pool_cache_stats()["fonts"]
+    assert fonts["processes"] == len(pids)
+    # each process also looked up size 40 as it started, and counts only
+    # its own lookups, not those of the process it was forked from
+    assert fonts["hits"] + fonts["misses"] == 6 + len(pids)
+    assert fonts["misses"] <= len(pids)
+    assert "render_queue" not in executor.pool_cache_stats()
+
+
+def test_pool_is_replaced_when_a_process_dies(executor):
+    executor.run(load_font, 40)
+    broken = executor.pool
+    with pytest.raises(BrokenProcessPool):
+        executor.run(crash)
+    assert executor.process_stats == {}
+
+    executor.run(load_font, 40)
+    assert executor.pool is not broken
+    assert broken._shutdown_thread
+
+
+def test_full_queue_is_rejected(executor):
+    executor.pending = executor.max_pending
+    with pytest.raises(RenderQueueFullError):
+        executor.run(load_font, 40)
+    assert executor.rejected == 1
+
+
+def test_merge_stats():
+    merged = merge_stats(
+        [
+            {"items": 1, "max_items": 4, "hits": 3, "misses": 1, "hit_ratio": 0.75},
+            {"items": 2, "max_items": 4, "hits": 0, "misses": 4, "hit_ratio": 0.0},
+        ]
+    )
+    assert merged == {
+        "processes": 2,
+        "items": 3,
+        "max_items": 4,
+        "hits": 3,
+        "misses": 5,
+        "hit_ratio": 3 / 8,
+    }
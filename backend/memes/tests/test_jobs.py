@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from django.test import Client
+from django.utils import timezone
+
+from memes import views
+from memes.models import Meme
+
+pytestmark = [pytest.mark.django_db, pytest.mark.usefixtures("local_storage")]
+
+
+def pending_meme(**fields):
+    fields.setdefault("status", Meme.Status.PENDING)
+    return Meme.objects.create(
+        image_url="https://example.com/template.png",
+        top_text="STILL",
+        bottom_text="RENDERING",
+        **fields,
+    )
+
+
+def test_serving_a_pending_meme_returns_202_at_once():
+    meme = pending_meme()
+    start = time.monotonic()
+    response = Client().get(f"/images/{meme.id}/")
+    assert time.monotonic() - start < 1
+    assert response.status_code == 202
+    assert response.json() == {"id": str(meme.id), "status": "pending"}
+    assert response["Retry-After"] == "1"
+
+
+def test_job_that_fails_to_save_is_marked_failed(monkeypatch):
+    meme = pending_meme()
+    monkeypatch.setattr(views, "generate_meme", lambda *args: object())
+
+    def broken(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(views, "store_derivatives", broken)
+    views.run_meme_job(meme.id)
+
+    meme.refresh_from_db()
+    assert meme.status == Meme.Status.FAILED
+    assert meme.error == "Failed to save meme: disk full"
+    assert meme.started_at is not None
+
+
+class FillingUp(dict):
+    """Derivatives the disk fills up partway through saving."""
+
+    def items(self):
+        yield from super().items()
+        raise OSError("disk full")
+
+
+def test_failed_job_deletes_the_derivatives_it_saved(local_storage, monkeypatch):
+    meme = pending_meme(format="png")
+    rendered = SimpleNamespace(derivatives=FillingUp({(64, "png"): b"derivative"}))
+    monkeypatch.setattr(views, "generate_meme", lambda *args: rendered)
+    views.run_meme_job(meme.id)
+
+    meme.refresh_from_db()
+    assert meme.status == Meme.Status.FAILED
+    assert [path for path in local_storage.rglob("*") if path.is_file()] == []
+
+
+def test_resume_jobs_goes_by_when_memes_were_claimed(settings, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        views.job_queue, "submit", lambda func, *args: submitted.append(args[0])
+    )
+    long_ago = timezone.now() - timedelta(seconds=settings.MEMES_JOB_TIMEOUT + 1)
+
+    # created long ago, but only just claimed after a long queue
+    busy = pending_meme(status=Meme.Status.RENDERING, started_at=timezone.now())
+    # claimed long ago, by a worker that died
+    stale = pending_meme(status=Meme.Status.RENDERING, started_at=long_ago)
+    # claimed before started_at was recorded
+    legacy = pending_meme(status=Meme.Status.RENDERING)
+    Meme.objects.filter(id__in=[busy.id, legacy.id]).update(created_at=long_ago)
+
+    assert views.resume_jobs() == 2
+    assert set(submitted) == {stale.id, legacy.id}
+    busy.refresh_from_db()
+    assert busy.status == Meme.Status.RENDERING
@@ -0,0 +1,65 @@
+import base64
+from datetime import timedelta
+
+import pytest
+from django.test import Client
+from django.utils import timezone
+
+from memes.models import Meme
+
+pytestmark = pytest.mark.django_db
+
+
+def walk(url):
+    """Every meme listed, following next from url to the last page."""
+    ids, pages = [], 0
+    while url:
+        response = Client().get(url)
+        assert response.status_code == 200
+        data = response.json()
+        ids.extend(meme["id"] for meme in data["results"])
+        url = data["next"]
+        pages += 1
+    return ids, pages
+
+
+def test_pages_through_memes_created_at_the_same_time():
+    now = timezone.now()
+    tied = [
+        Meme.objects.create(image_url="https://example.com/a.png") for _ in range(7)
+    ]
+    Meme.objects.filter(id__in=[m.id for m in tied]).update(created_at=now)
+    older = Meme.objects.create(image_url="https://example.com/b.png")
+    Meme.objects.filter(id=older.id).update(created_at=now - timedelta(seconds=1))
+    newer = Meme.objects.create(image_url="https://example.com/a.png")
+    Meme.objects.filter(id=newer.id).update(created_at=now + timedelta(seconds=1))
+
+    ids, pages = walk("/api/memes/?limit=3")
+    tied_ids = sorted((str(m.id) for m in tied), reverse=True)
+    assert ids == [str(newer.id), *tied_ids, str(older.id)]
+    assert pages == 3
+
+    ids, pages = walk("/api/memes/?limit=2&image_url=https://example.com/a.png")
+    assert ids == [str(newer.id), *tied_ids]
+    assert pages == 4
+
+
+def cursor(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "garbage",
+        "%%%",
+        cursor("no separator"),
+        cursor("yesterday|" + "0" * 32),
+        cursor(f"{timezone.now().isoformat()}|not-a-uuid"),
+        base64.urlsafe_b64encode(b"\xff\xfe|").decode(),
+    ],
+)
+def test_garbage_cursor_is_a_bad_request(value):
+    response = Client().get("/api/memes/", {"cursor": value})
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid cursor"}
@@ -0,0 +1,15 @@
+import pytest
+
+from memes.management.commands.bench_outline import pixel_diff, render
+
+# the same defaults as bench_outline
+THRESHOLD = 64
+TOLERANCE = 0.02
+
+
+@pytest.mark.parametrize("font_size", [20, 40, 80, 120, 200])
+def test_stroke_outline_matches_legacy(font_size):
+    legacy = render("legacy", "SPANS EVERYWHERE", font_size)
+    stroke = render("stroke", "SPANS EVERYWHERE", font_size)
+    assert legacy.size == stroke.size
+    assert pixel_diff(legacy, stroke, THRESHOLD) <= TOLERANCE
@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import Client
+
+from memes.models import meme_image_name
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def meme_id(local_storage, settings):
+    # from the file, so every request goes through image_response
+    settings.MEMES_HOT_CACHE_BYTES = 0
+    meme_id = uuid.uuid4()
+    default_storage.save(meme_image_name(meme_id, "png"), ContentFile(CONTENT))
+    return meme_id
+
+
+def get(meme_id, **headers):
+    response = Client().get(f"/images/{meme_id}/", headers=headers)
+    body = b"".join(response) if response.status_code != 304 else b""
+    return response, body
+
+
+def test_image_is_sent_with_validators(meme_id):
+    response, body = get(meme_id)
+    assert response.status_code == 200
+    assert body == CONTENT
+    assert response["ETag"] == f'"{meme_id}"'
+    assert response["Last-Modified"]
+    assert "immutable" in response["Cache-Control"]
+
+
+def test_matching_etag_is_not_modified(meme_id):
+    response, _ = get(meme_id, if_none_match=f'W/"other", "{meme_id}"')
+    assert response.status_code == 304
+    assert response["ETag"] == f'"{meme_id}"'
+
+
+def test_other_etag_gets_the_image(meme_id):
+    response, body = get(meme_id, if_none_match='"other"')
+    assert response.status_code == 200
+    assert body == CONTENT
+
+
+def test_if_modified_since_is_not_modified(meme_id):
+    last_modified = get(meme_id)[0]["Last-Modified"]
+    response, _ = get(meme_id, if_modified_since=last_modified)
+    assert response.status_code == 304
+
+
+def test_if_none_match_takes_precedence(meme_id):
+    last_modified = get(meme_id)[0]["Last-Modified"]
+    response, body = get(
+        meme_id, if_none_match='"other"', if_modified_since=last_modified
+    )
+    assert response.status_code == 200
+    assert body == CONTENT
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [
+        ("bytes=10-19", 10, 19),
+        ("bytes=1000-", 1000, 1023),
+        ("bytes=1000-5000", 1000, 1023),
+        ("bytes=-24", 1000, 1023),
+        ("bytes=-5000", 0, 1023),
+    ],
+)
+def test_range(meme_id, header, start, end):
+    response, body = get(meme_id, range=header)
+    assert response.status_code == 206
+    assert body == CONTENT[start : end + 1]
+    assert response["Content-Range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=20-10"])
+def test_unsatisfiable_range(meme_id, header):
+    response, _ = get(meme_id, range=header)
+    assert response.status_code == 416
+    assert response["Content-Range"] == f"bytes */{len(CONTENT)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-9", "lines=1-2", "bytes=-"])
+def test_unsupported_range_gets_the_image(meme_id, header):
+    response, body = get(meme_id, range=header)
+    assert response.status_code == 200
+    assert body == CONTENT
+
+
+def test_stale_if_range_gets_the_image(meme_id):
+    response, body = get(meme_id, range="bytes=0-9", if_range='"other"')
+    assert response.status_code == 200
+    assert body == CONTENT
@@ -0,0 +1,157 @@
+import io
+import os
+import struct
+import uuid
+import zlib
+
+import httpx
+import pytest
+from PIL import Image
+
+from memes.sources import (
+    CappedDownload,
+    SourceCache,
+    SourceImageError,
+    SourceImageTooLargeError,
+)
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def png(width=8, height=8, color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def png_chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def png_header(width, height):
+    """A tiny PNG whose header claims these dimensions."""
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + png_chunk(b"IDAT", zlib.compress(b"\0" * 1024))
+    )
+
+
+class Origin:
+    """A stub origin server, recording the requests it gets."""
+
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        validators = [
+            (self.headers.get("etag"), request.headers.get("if-none-match")),
+            (
+                self.headers.get("last-modified"),
+                request.headers.get("if-modified-since"),
+            ),
+        ]
+        if any(ours and ours == theirs for ours, theirs in validators):
+            return httpx.Response(304, headers=self.headers)
+        return httpx.Response(200, headers=self.headers, content=self.content)
+
+
+def make_cache(directory, origin, **kwargs):
+    return SourceCache(
+        f"test-sources-{uuid.uuid4().hex}",
+        str(directory),
+        max_bytes=1024 * 1024,
+        max_download_bytes=1024 * 1024,
+        max_pixels=1_000_000,
+        client=httpx.Client(transport=httpx.MockTransport(origin)),
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize(
+    "headers, conditional",
+    [
+        ({"etag": '"v1"', "cache-control": "max-age=0"}, "if-none-match"),
+        (
+            {"last-modified": LAST_MODIFIED, "cache-control": "no-cache"},
+            "if-modified-since",
+        ),
+    ],
+)
+def test_stale_entry_is_revalidated(tmp_path, headers, conditional):
+    origin = Origin(png(), headers)
+    cache = make_cache(tmp_path, origin)
+    url = "https://example.com/template.png"
+
+    first = cache.fetch(url)
+    assert conditional not in origin.requests[0].headers
+
+    second = cache.fetch(url)
+    assert origin.requests[1].headers[conditional] == headers.get("etag", LAST_MODIFIED)
+    assert second.content == first.content == origin.content
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["revalidations"] == 1
+
+    # another worker revalidates what the first one left on disk
+    other = make_cache(tmp_path, origin)
+    assert other.fetch(url).content == origin.content
+    assert conditional in origin.requests[2].headers
+    assert other.stats()["revalidations"] == 1
+
+
+def test_disk_tier_prunes_least_recently_used(tmp_path):
+    content = png()
+    origin = Origin(content, {"cache-control": "max-age=3600"})
+    # room for three and a half images, so pruning stops at three
+    cache = make_cache(tmp_path, origin, max_disk_bytes=len(content) * 7 // 2)
+    urls = [f"https://example.com/template-{i}.png" for i in range(4)]
+
+    for i, url in enumerate(urls[:3]):
+        cache.fetch(url)
+        os.utime(cache.path(url), (i, i))
+    # reading the first one from disk makes it the most recently used
+    cache.memory.clear()
+    cache.fetch(urls[0])
+    assert len(origin.requests) == 3
+
+    cache.fetch(urls[3])
+    assert not os.path.exists(cache.path(urls[1]))
+    assert not os.path.exists(f"{cache.path(urls[1])}.json")
+    for url in (urls[0], urls[2], urls[3]):
+        assert os.path.exists(cache.path(url))
+    assert cache.stats()["disk_evictions"] == 1
+    assert cache.stats()["disk_bytes"] == len(content) * 3
+
+
+@pytest.mark.parametrize(
+    "width, height",
+    [
+        # over our limit, but not Pillow's
+        (8000, 8000),
+        # over Pillow's decompression bomb limit too
+        (15000, 15000),
+    ],
+)
+def test_oversized_header_is_rejected(width, height):
+    download = CappedDownload("https://example.com/bomb.png", 1024 * 1024, 40_000_000)
+    with pytest.raises(SourceImageTooLargeError, match="too large"):
+        download.feed(png_header(width, height))
+
+
+def test_oversized_header_is_rejected_by_fetch(tmp_path):
+    origin = Origin(png_header(15000, 15000), {})
+    cache = make_cache(tmp_path, origin)
+    with pytest.raises(SourceImageTooLargeError):
+        cache.fetch("https://example.com/bomb.png")
+    assert cache.stats()["misses"] == 0
+
+
+def test_not_an_image_is_rejected(tmp_path):
+    origin = Origin(b"<html>not found</html>", {})
+    cache = make_cache(tmp_path, origin)
+    with pytest.raises(SourceImageError, match="invalid"):
+        cache.fetch("https://example.com/template.png")
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from memes import views
 
@@ -5,7 +6,15 @@ app_name = "memes"
 
 urlpatterns = [
     path("", views.health_check, name="health_check"),
-    path("api/create/", views.create_meme, name="create_meme"),
+    path(
+        "api/create/",
+        views.acreate_meme if settings.MEMES_ASYNC else views.create_meme,
+        name="create_meme",
+    ),
+    path("api/create/batch/", views.create_memes, name="create_memes"),
+    path("api/memes/", views.list_memes, name="list_memes"),
     path("api/meme/<uuid:meme_id>/", views.get_meme, name="get_meme"),
+    path("api/meme/<uuid:meme_id>/events/", views.meme_events, name="meme_events"),
     path("images/<uuid:meme_id>/", views.serve_meme, name="serve_meme"),
+    path("api/stats/", views.stats, name="stats"),
 ]
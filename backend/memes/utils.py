@@ -1,19 +1,35 @@
+import hashlib
 import io
+import json
 import os
 import random
 import re
 import time
 from urllib.parse import urlparse
 import httpx
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from django.core.files.base import ContentFile
 from django.conf import settings
-from client import httpx_client
 from opentelemetry import trace
 from functools import wraps
+from dataclasses import dataclass
+from django.core.cache import caches
+
+from memes.cache import HitCounter, LRUCache
+from memes.executor import render_executor
+from memes.fonts import font_registry
+from memes.sources import source_cache
 
 tracer = trace.get_tracer("memes.generate")
 
+# Captions are measured at this size to predict the size that will fit
+REFERENCE_FONT_SIZE = 100
+# We never shrink captions below this, even if they overflow
+MIN_FONT_SIZE = 20
+# Bump this when a rendering change alters the output for the same inputs, so
+# we stop reusing memes that were rendered the old way
+RENDER_VERSION = 1
+
 
 def span_decorator(f):
     @wraps(f)
@@ -26,73 +42,125 @@ def span_decorator(f):
 
 def load_impact_font(size):
     """Load Impact font with fallbacks, centralized font loading utility."""
-    try:
-        # Try unicode Impact font first for emoji support
-        impact_path = os.path.join(settings.MEDIA_ROOT, "fonts", "unicode.impact.ttf")
-        if not os.path.exists(impact_path):
-            impact_path = os.path.join(settings.MEDIA_ROOT, "fonts", "impact.ttf")
-        if not os.path.exists(impact_path):
-            # Fallback to project media directory
-            impact_path = "/home/wavy/otelmewhy/media/fonts/unicode.impact.ttf"
-            if not os.path.exists(impact_path):
-                impact_path = "/home/wavy/otelmewhy/media/fonts/impact.ttf"
-        return ImageFont.truetype(impact_path, size)
-    except (OSError, IOError):
-        try:
-            # Try to use a bolder system font
-            return ImageFont.truetype(
-                "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", size
-            )
-        except (OSError, IOError):
-            try:
-                return ImageFont.truetype(
-                    "/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf", size
-                )
-            except (OSError, IOError):
-                return ImageFont.load_default()
-
-
+    return font_registry.get(size)
+
+
+def meme_content_hash(image_url, top_text="", bottom_text="", output_format="png"):
+    """Hash of everything that determines what a generated meme looks like."""
+    key = {
+        "format": output_format,
+        "encode_options": encode_options(output_format),
+        "image_url": image_url.strip(),
+        # captions are always drawn in upper case
+        "top_text": top_text.upper(),
+        "bottom_text": bottom_text.upper(),
+        "render_version": RENDER_VERSION,
+        "outline_renderer": settings.MEMES_OUTLINE_RENDERER,
+        "font": os.path.basename(font_registry.path or "default"),
+        "max_output_size": settings.MEMES_MAX_OUTPUT_SIZE,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
 
 
 def fetch_image(image_url):
-    """Fetch image from URL and return PIL Image object."""
-    response = httpx_client.get(image_url)
-    response.raise_for_status()
-    content = io.BytesIO(response.content)
-    return Image.open(content)
+    """Fetch image from URL, or the source cache, and return PIL Image object."""
+    source = source_cache.fetch(image_url)
+    return Image.open(io.BytesIO(source.content))
 
 
 def calculate_font_size(text, image_width, image_height):
-    """Calculate optimal font size based on text length and image dimensions."""
+    """Calculate optimal font size based on text length and image dimensions.
+
+    Caption width scales almost linearly with point size, so we measure the
+    text once at a reference size, predict the size that fits, and then
+    binary search a narrow window around the prediction to confirm it.
+    """
     if not text:
         return 40
 
+    text = text.upper()
     max_font_size = min(image_width // 2, image_height // 3)
 
-    test_font = load_impact_font(max_font_size)
-    if test_font == ImageFont.load_default():
+    if font_registry.path is None:
+        # Pillow's default font, so don't try and go big
         max_font_size = 40
 
+    if max_font_size <= MIN_FONT_SIZE:
+        return MIN_FONT_SIZE
+
     margin_percent = 0.1
     margin = image_width * margin_percent
     available_width = image_width - (2 * margin)
 
-    font_size = max_font_size
-    while font_size > 20:
-        try:
-            current_font = load_impact_font(font_size)
+    def text_width(size):
+        bbox = load_impact_font(size).getbbox(text)
+        return bbox[2] - bbox[0]
+
+    def fits(size):
+        return text_width(size) <= available_width
+
+    reference_width = text_width(REFERENCE_FONT_SIZE)
+    if reference_width <= 0:
+        return max_font_size
+
+    predicted = int(available_width * REFERENCE_FONT_SIZE / reference_width)
+    predicted = min(max(predicted, MIN_FONT_SIZE), max_font_size)
+
+    # Hinting and kerning mean width is not exactly linear in size, so the
+    # answer is close to the prediction but not always on it. Bracket it with
+    # lo (fits) and hi (too wide), then bisect.
+    window = max(2, predicted // 20)
+    if fits(predicted):
+        lo = predicted
+        hi = min(predicted + window, max_font_size + 1)
+        if hi <= max_font_size and fits(hi):
+            lo, hi = hi, max_font_size + 1
+    else:
+        hi = predicted
+        lo = max(predicted - window, MIN_FONT_SIZE)
+        if lo > MIN_FONT_SIZE and not fits(lo):
+            lo, hi = MIN_FONT_SIZE, lo
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
+
+    return lo
+
+
+def draw_outline_offsets(
+    draw, text, position, font, fill_color, outline_color, outline_width
+):
+    """Legacy outline: redraw the text at every offset in a square around it."""
+    x, y = position
+    for dx in range(-outline_width, outline_width + 1):
+        for dy in range(-outline_width, outline_width + 1):
+            if dx != 0 or dy != 0:
+                draw.text((x + dx, y + dy), text, font=font, fill=outline_color)
+    draw.text(position, text, font=font, fill=fill_color)
 
-            bbox = current_font.getbbox(text.upper())
-            text_width = bbox[2] - bbox[0]
 
-            if text_width <= available_width:
-                return font_size
+def draw_outline_stroke(
+    draw, text, position, font, fill_color, outline_color, outline_width
+):
+    """Outline with a FreeType stroke, rasterising the text once."""
+    draw.text(
+        position,
+        text,
+        font=font,
+        fill=fill_color,
+        stroke_width=outline_width,
+        stroke_fill=outline_color,
+    )
 
-            font_size = int(font_size * 0.9)
-        except Exception as e:
-            break
 
-    return max(font_size, 20)
+OUTLINE_RENDERERS = {
+    "legacy": draw_outline_offsets,
+    "stroke": draw_outline_stroke,
+}
 
 
 def draw_text_with_outline(
@@ -103,36 +171,184 @@ def draw_text_with_outline(
     fill_color="white",
     outline_color="black",
     outline_width=2,
+    renderer=None,
 ):
-    """Draw text with outline."""
-    x, y = position
-    text = text.upper()
+    """Draw text with outline, using the configured outline renderer."""
+    render = OUTLINE_RENDERERS[renderer or settings.MEMES_OUTLINE_RENDERER]
+    render(draw, text.upper(), position, font, fill_color, outline_color, outline_width)
+
+
+@span_decorator
+def decode_image(content, max_size=None):
+    """Fully decode image bytes into a PIL Image.
+
+    JPEGs bigger than max_size in either dimension are decoded at a reduced
+    scale, which is much cheaper than decoding them in full and resizing.
+    """
+    image = Image.open(io.BytesIO(content))
+    if max_size and max(image.size) > max_size:
+        # only JPEG supports this, and it's a no-op for everything else
+        image.draft("RGB", (max_size, max_size))
+    image.load()
+    return image
+
+
+@span_decorator
+def convert_to_rgb(image):
+    """Flatten an image onto white and convert it to RGB for drawing on."""
+    if image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(
+            image,
+            mask=image.split()[-1] if image.mode == "RGBA" else None,
+        )
+        return background
+    elif image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+@span_decorator
+def downscale(image, max_size):
+    """Shrink an image to fit within max_size x max_size, keeping its aspect."""
+    span = trace.get_current_span()
+    span.set_attribute("image.source_size", f"{image.width}x{image.height}")
+    if max_size and max(image.size) > max_size:
+        # thumbnail reduces by an integer factor first, then resamples the rest
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    span.set_attribute("image.output_size", f"{image.width}x{image.height}")
+    return image
+
+
+def image_nbytes(image):
+    """Rough size in memory of a decoded image."""
+    return image.width * image.height * len(image.getbands())
+
+
+# decoded RGB templates, keyed by source url, validator and max output size
+base_images = LRUCache(
+    "base_images",
+    max_bytes=settings.MEMES_BASE_IMAGE_CACHE_BYTES,
+    sizeof=image_nbytes,
+)
+
+
+def get_base_image(image_url, validator, content):
+    """Return an RGB copy of the decoded source image that is safe to draw on."""
+    max_size = settings.MEMES_MAX_OUTPUT_SIZE
+    key = (image_url, validator, max_size)
+    base_image = base_images.get(key)
+    trace.get_current_span().set_attribute(
+        "base_image_cache.hit", base_image is not None
+    )
+    if base_image is None:
+        image = convert_to_rgb(decode_image(content, max_size))
+        base_image = downscale(image, max_size)
+        base_images.set(key, base_image)
+    # the cached image is shared, so always draw on a copy
+    return base_image.copy()
+
+
+def load_base_image(image_url):
+    """Fetch an image and return an RGB copy of it that is safe to draw on."""
+    source = source_cache.fetch(image_url)
+    return get_base_image(source.url, source.validator, source.content)
+
+
+@dataclass(frozen=True)
+class CaptionOverlay:
+    """A rasterised caption: coverage masks for its outline and its fill."""
+
+    outline_mask: Image.Image
+    fill_mask: Image.Image
+    # where the masks go, relative to the caption's draw position
+    offset: tuple
+
+    @property
+    def nbytes(self):
+        return image_nbytes(self.outline_mask) + image_nbytes(self.fill_mask)
+
+
+# rasterised captions for this worker, keyed by text, font size and outline
+overlays = LRUCache(
+    "overlays",
+    max_bytes=settings.MEMES_OVERLAY_CACHE_BYTES,
+    sizeof=lambda overlay: overlay.nbytes,
+)
+
+
+def render_caption_overlay(text, font, outline_width, renderer=None):
+    """Rasterise a caption into outline and fill masks, once."""
+    bbox = font.getbbox(text)
+    # strokes spread outline_width beyond the glyphs, plus a pixel of antialiasing
+    padding = outline_width + 1
+    size = (bbox[2] - bbox[0] + 2 * padding, bbox[3] - bbox[1] + 2 * padding)
+    origin = (padding - bbox[0], padding - bbox[1])
+
+    outline_mask = Image.new("L", size, 0)
+    draw_text_with_outline(
+        ImageDraw.Draw(outline_mask),
+        text,
+        origin,
+        font,
+        fill_color=255,
+        outline_color=255,
+        outline_width=outline_width,
+        renderer=renderer,
+    )
+    fill_mask = Image.new("L", size, 0)
+    ImageDraw.Draw(fill_mask).text(origin, text, font=font, fill=255)
 
-    for dx in range(-outline_width, outline_width + 1):
-        for dy in range(-outline_width, outline_width + 1):
-            if dx != 0 or dy != 0:
-                draw.text((x + dx, y + dy), text, font=font, fill=outline_color)
-    draw.text(position, text, font=font, fill=fill_color)
+    return CaptionOverlay(outline_mask, fill_mask, (-origin[0], -origin[1]))
 
 
-def generate_meme(image_url, top_text="", bottom_text=""):
-    """Generate a meme by adding text to an image."""
-    base_image = fetch_image(image_url)
+def get_caption_overlay(text, font_size, outline_width):
+    """Return the rasterised caption, from cache if we can."""
+    renderer = settings.MEMES_OUTLINE_RENDERER
+    key = (text, font_size, outline_width, renderer, font_registry.path)
+    overlay = overlays.get(key)
+    if overlay is None:
+        font = load_impact_font(font_size)
+        overlay = render_caption_overlay(text, font, outline_width, renderer)
+        overlays.set(key, overlay)
+    return overlay
 
-    if base_image.mode in ("RGBA", "LA"):
-        background = Image.new("RGB", base_image.size, (255, 255, 255))
-        background.paste(
-            base_image,
-            mask=base_image.split()[-1] if base_image.mode == "RGBA" else None,
-        )
-        base_image = background
-    elif base_image.mode != "RGB":
-        base_image = base_image.convert("RGB")
 
-    draw = ImageDraw.Draw(base_image)
+def paste_caption_overlay(
+    image, overlay, position, fill_color="white", outline_color="black"
+):
+    """Composite a rasterised caption onto an image at the draw position."""
+    box = (position[0] + overlay.offset[0], position[1] + overlay.offset[1])
+    image.paste(outline_color, box, overlay.outline_mask)
+    image.paste(fill_color, box, overlay.fill_mask)
 
-    width, height = base_image.size
 
+@dataclass(frozen=True)
+class CaptionLayout:
+    """Where one caption is drawn, and its bounding box at that font size."""
+
+    text: str
+    x: int
+    y: int
+    bbox: tuple
+
+
+@dataclass(frozen=True)
+class MemeLayout:
+    """Everything needed to draw the captions on an image of a given size."""
+
+    font_size: int
+    outline_width: int
+    captions: tuple
+
+
+# caption layouts for this worker, keyed by captions and image size
+layouts = LRUCache("layouts", max_items=settings.MEMES_LAYOUT_CACHE_SIZE)
+shared_layouts = HitCounter("layouts.shared")
+
+
+def calculate_layout(top_text, bottom_text, width, height):
+    """Work out the font size and caption positions for an image size."""
     top_font_size = calculate_font_size(top_text, width, height)
     bottom_font_size = calculate_font_size(bottom_text, width, height)
 
@@ -143,24 +359,21 @@ def generate_meme(image_url, top_text="", bottom_text=""):
     )
 
     font = load_impact_font(font_size)
+    outline_width = max(font_size // 20, 3)
+    captions = []
 
     if top_text:
-        bbox = draw.textbbox((0, 0), top_text.upper(), font=font)
+        bbox = font.getbbox(top_text.upper())
         text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
 
         x = (width - text_width) // 2
         top_margin_percent = 0.05
         top_margin = max(int(height * top_margin_percent), 20)
         y = top_margin
-
-        outline_width = max(font_size // 20, 3)
-        draw_text_with_outline(
-            draw, top_text.upper(), (x, y), font, outline_width=outline_width
-        )
+        captions.append(CaptionLayout(top_text.upper(), x, y, bbox))
 
     if bottom_text:
-        bbox = draw.textbbox((0, 0), bottom_text.upper(), font=font)
+        bbox = font.getbbox(bottom_text.upper())
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
 
@@ -168,15 +381,244 @@ def generate_meme(image_url, top_text="", bottom_text=""):
         bottom_margin_percent = 0.05
         bottom_margin = max(int(height * bottom_margin_percent), 20)
         y = height - text_height - bottom_margin
+        captions.append(CaptionLayout(bottom_text.upper(), x, y, bbox))
+
+    return MemeLayout(font_size, outline_width, tuple(captions))
+
+
+def get_layout(top_text, bottom_text, width, height):
+    """Return the layout for these captions and image size, from cache if we can."""
+    key = layout_cache_key(top_text, bottom_text, width, height)
+    layout = layouts.get(key)
+    span = trace.get_current_span()
+    span.set_attribute("layout_cache.hit", layout is not None)
+    if layout is not None:
+        return layout
+
+    shared = None
+    if settings.MEMES_LAYOUT_SHARED_CACHE:
+        shared = caches[settings.MEMES_LAYOUT_SHARED_CACHE]
+        layout = shared.get(key)
+        if layout is not None:
+            shared_layouts.hit()
+            layouts.set(key, layout)
+            span.set_attribute("layout_cache.shared_hit", True)
+            return layout
+        shared_layouts.miss()
+
+    layout = calculate_layout(top_text, bottom_text, width, height)
+    layouts.set(key, layout)
+    if shared is not None:
+        shared.set(key, layout)
+    return layout
+
+
+def layout_cache_key(top_text, bottom_text, width, height):
+    key = [
+        RENDER_VERSION,
+        os.path.basename(font_registry.path or "default"),
+        top_text.upper(),
+        bottom_text.upper(),
+        width,
+        height,
+    ]
+    digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+    return f"memes:layout:{digest}"
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    pil_format: str
+    content_type: str
+    extension: str
+
+
+OUTPUT_FORMATS = {
+    "png": OutputFormat("PNG", "image/png", "png"),
+    "webp": OutputFormat("WEBP", "image/webp", "webp"),
+    "jpeg": OutputFormat("JPEG", "image/jpeg", "jpg"),
+}
+
+
+def encode_options(output_format):
+    """The Pillow save() options for an output format, from settings."""
+    if output_format == "png":
+        return {
+            "compress_level": settings.MEMES_PNG_COMPRESS_LEVEL,
+            "optimize": settings.MEMES_PNG_OPTIMIZE,
+        }
+    if output_format == "webp":
+        return {"quality": settings.MEMES_WEBP_QUALITY, "method": 4}
+    if output_format == "jpeg":
+        return {"quality": settings.MEMES_JPEG_QUALITY, "progressive": True}
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def choose_output_format(requested=None, accept=""):
+    """Pick the output format from an explicit request or an Accept header.
+
+    Raises ValueError for an explicitly requested format we don't support.
+    Wildcards in Accept are ignored, so clients get the default format unless
+    they name one of ours.
+    """
+    if requested:
+        requested = requested.lower()
+        if requested == "jpg":
+            requested = "jpeg"
+        if requested not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported format: {requested}")
+        return requested
+
+    content_types = {fmt.content_type: name for name, fmt in OUTPUT_FORMATS.items()}
+    best, best_quality = None, 0.0
+    for item in accept.split(","):
+        content_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if content_type in content_types and quality > best_quality:
+            best, best_quality = content_types[content_type], quality
+    return best or settings.MEMES_OUTPUT_FORMAT
+
+
+@span_decorator
+def encode_image(image, output_format="png"):
+    """Encode an image in one of OUTPUT_FORMATS."""
+    output = io.BytesIO()
+    image.save(
+        output,
+        format=OUTPUT_FORMATS[output_format].pil_format,
+        **encode_options(output_format),
+    )
+    trace.get_current_span().set_attribute("meme.output_bytes", output.tell())
+    return output.getvalue()
+
 
-        outline_width = max(font_size // 20, 3)
-        draw_text_with_outline(
-            draw, bottom_text.upper(), (x, y), font, outline_width=outline_width
+@dataclass(frozen=True)
+class RenderedMeme:
+    """An encoded meme, and its derivatives from render_derivatives."""
+
+    content: bytes
+    derivatives: dict
+
+
+class MemeFile(ContentFile):
+    """A rendered meme image to save, which carries its derivatives with it."""
+
+    def __init__(self, rendered, output_format):
+        super().__init__(
+            rendered.content, name=f"meme.{OUTPUT_FORMATS[output_format].extension}"
         )
+        self.derivatives = rendered.derivatives
 
-    output = io.BytesIO()
 
-    base_image.save(output, format="PNG")
-    output.seek(0)
+def render_meme(image_url, validator, content, top_text, bottom_text, output_format):
+    """Draw the captions on a source image and encode it, and its derivatives.
+
+    This does no I/O, so that it can run in the render pool.
+    """
+    base_image = get_base_image(image_url, validator, content)
+    return draw_meme(base_image, top_text, bottom_text, output_format)
+
+
+def render_memes(image_url, validator, content, captions):
+    """Render several memes on the same source image, in one go.
+
+    captions is a list of (top_text, bottom_text, output_format), and the
+    RenderedMemes are returned in the same order. The source is decoded once,
+    and only needs sending to the render pool once.
+    """
+    base_image = get_base_image(image_url, validator, content)
+    return [
+        draw_meme(base_image.copy(), top_text, bottom_text, output_format)
+        for top_text, bottom_text, output_format in captions
+    ]
 
-    return ContentFile(output.getvalue(), name=f"meme.png")
+
+def draw_meme(base_image, top_text, bottom_text, output_format):
+    """Draw the captions on base_image, which is changed, and encode it.
+
+    Derivatives are scaled down from the same drawn image, so they cost a
+    resize and an encode each, rather than a render.
+    """
+    draw = ImageDraw.Draw(base_image)
+
+    width, height = base_image.size
+    layout = get_layout(top_text, bottom_text, width, height)
+    font = load_impact_font(layout.font_size)
+
+    for caption in layout.captions:
+        if settings.MEMES_OVERLAY_CACHE:
+            overlay = get_caption_overlay(
+                caption.text, layout.font_size, layout.outline_width
+            )
+            paste_caption_overlay(base_image, overlay, (caption.x, caption.y))
+        else:
+            draw_text_with_outline(
+                draw,
+                caption.text,
+                (caption.x, caption.y),
+                font,
+                outline_width=layout.outline_width,
+            )
+
+    return RenderedMeme(
+        encode_image(base_image, output_format), render_derivatives(base_image)
+    )
+
+
+@span_decorator
+def render_derivatives(image):
+    """Encode smaller copies of a meme, for MEMES_DERIVATIVE_WIDTHS and _FORMATS.
+
+    Returns {(width, format): encoded bytes}. Widths the image isn't wider than
+    are skipped, since the image itself is the nearest match for them.
+    """
+    derivatives = {}
+    original_width, original_height = image.size
+    # widest first, so each is scaled down from the last, not the full image
+    for width in sorted(set(settings.MEMES_DERIVATIVE_WIDTHS), reverse=True):
+        if width >= original_width:
+            continue
+        height = max(round(original_height * width / original_width), 1)
+        image = image.resize(
+            (width, height), Image.Resampling.LANCZOS, reducing_gap=3.0
+        )
+        for output_format in settings.MEMES_DERIVATIVE_FORMATS:
+            derivatives[width, output_format] = encode_image(image, output_format)
+    return derivatives
+
+
+def generate_meme(image_url, top_text="", bottom_text="", output_format="png"):
+    """Generate a meme by adding text to an image."""
+    source = source_cache.fetch(image_url)
+    rendered = render_executor.run(
+        render_meme,
+        source.url,
+        source.validator,
+        source.content,
+        top_text,
+        bottom_text,
+        output_format,
+    )
+    return MemeFile(rendered, output_format)
+
+
+async def agenerate_meme(image_url, top_text="", bottom_text="", output_format="png"):
+    """Async version of generate_meme, for the ASGI request path."""
+    source = await source_cache.afetch(image_url)
+    rendered = await render_executor.arun(
+        render_meme,
+        source.url,
+        source.validator,
+        source.content,
+        top_text,
+        bottom_text,
+        output_format,
+    )
+    return MemeFile(rendered, output_format)
@@ -1,12 +1,78 @@
+import asyncio
+import base64
+import binascii
+import contextvars
 import json
-from django.http import HttpResponse, JsonResponse, Http404
+import re
+from asgiref.sync import sync_to_async
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from django.db import transaction
+from django.db.models import Q
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.views.decorators.http import require_http_methods
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
 from django.conf import settings
 import os
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 
-from memes.models import Meme
-from memes.utils import generate_meme
+from memes.cache import HitCounter, LRUCache, cache_stats
+from memes.executor import RenderQueueFullError, render_executor
+from memes.jobs import job_queue
+from memes.models import Meme, meme_derivative_name, meme_image_name
+from memes.sources import SourceImageError, source_cache
+from memes.utils import (
+    OUTPUT_FORMATS,
+    agenerate_meme,
+    choose_output_format,
+    generate_meme,
+    meme_content_hash,
+    render_memes,
+)
+
+tracer = trace.get_tracer("memes.views")
+
+dedupe_counter = HitCounter("dedupe")
+
+
+@dataclass(frozen=True)
+class HotMeme:
+    """The bytes of a recently created or served meme image."""
+
+    content: bytes
+    format: str
+    # timestamp for Last-Modified
+    modified: float
+
+
+def len_content(hot):
+    return len(hot.content)
+
+
+# Memes are usually viewed straight after they're created, so keep the most
+# recent ones in memory rather than reading them back from the disk
+hot_memes = LRUCache(
+    "hot_memes",
+    max_bytes=settings.MEMES_HOT_CACHE_BYTES,
+    sizeof=len_content,
+    ttl=settings.MEMES_HOT_CACHE_TTL,
+)
 
 
 def health_check(request):
@@ -14,73 +80,1128 @@ def health_check(request):
     return HttpResponse("PyCon UK 2025 Workshop - Backend API")
 
 
-@require_http_methods(["POST"])
-def create_meme(request):
-    """JSON API endpoint to create a meme."""
+def parse_meme_request(request):
+    """Validate a create request, and return the fields for the new Meme.
+
+    Raises ValueError with a message for the client if the request is invalid.
+    """
     try:
         data = json.loads(request.body)
     except json.JSONDecodeError:
-        return JsonResponse({"error": "Invalid JSON"}, status=400)
+        raise ValueError("Invalid JSON")
+
+    return parse_meme_spec(data, request.headers.get("Accept", ""))
+
+
+def parse_meme_spec(data, accept):
+    """Validate one meme's worth of create request data."""
+    if not isinstance(data, dict):
+        raise ValueError("Each meme must be a JSON object")
 
     image_url = data.get("image_url")
     top_text = data.get("top_text", "")
     bottom_text = data.get("bottom_text", "")
+    requested_format = data.get("format")
 
     if not image_url:
-        return JsonResponse({"error": "image_url is required"}, status=400)
+        raise ValueError("image_url is required")
+    # anything else JSON can hold would only fail later, in the hashing
+    for name, value in [
+        ("image_url", image_url),
+        ("top_text", top_text),
+        ("bottom_text", bottom_text),
+        ("format", requested_format or ""),
+    ]:
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
 
+    output_format = choose_output_format(requested_format, accept)
+
+    return {
+        "image_url": image_url,
+        "top_text": top_text,
+        "bottom_text": bottom_text,
+        "format": output_format,
+        "content_hash": meme_content_hash(
+            image_url, top_text, bottom_text, output_format
+        ),
+    }
+
+
+def find_rendered_image(content_hash):
+    """Return the name of an already rendered image with this content hash.
+
+    Returns None if there isn't one, or if deduplication is turned off.
+    """
+    if not settings.MEMES_DEDUPE:
+        return None
+
+    meme_file = None
+    existing = (
+        Meme.objects.filter(content_hash=content_hash).only("generated_image").first()
+    )
+    if existing and existing.generated_image:
+        image = existing.generated_image
+        if image.storage.exists(image.name):
+            meme_file = image.name
+    if meme_file:
+        dedupe_counter.hit()
+    else:
+        dedupe_counter.miss()
+    trace.get_current_span().set_attribute("meme.deduplicated", bool(meme_file))
+    return meme_file
+
+
+def find_rendered_images(content_hashes):
+    """Like find_rendered_image, for many content hashes in one query.
+
+    Returns a dict of content hash to image name, for those we've rendered.
+    """
+    if not settings.MEMES_DEDUPE or not content_hashes:
+        return {}
+
+    found = {}
+    existing = Meme.objects.filter(content_hash__in=content_hashes).values_list(
+        "content_hash", "generated_image"
+    )
+    for content_hash, name in existing:
+        if name and content_hash not in found and default_storage.exists(name):
+            found[content_hash] = name
+    for _ in found:
+        dedupe_counter.hit()
+    for _ in range(len(content_hashes) - len(found)):
+        dedupe_counter.miss()
+    return found
+
+
+def save_meme(fields, meme_file):
+    """Create a Meme with a newly rendered image, or an existing one's name.
+
+    Images are stored at a path worked out from the meme's id, so an existing
+    image is hard linked there rather than shared by name.
+    """
+    meme = Meme(**fields)
+    store_derivatives(meme, meme_file)
+    if isinstance(meme_file, str):
+        meme_file = link_image(
+            meme_file, meme_image_name(meme.id, OUTPUT_FORMATS[meme.format].extension)
+        )
+    meme.generated_image = meme_file
+    meme.save()
+    remember_hot_meme(meme, meme_file)
+    return meme
+
+
+def remember_hot_meme(meme, meme_file):
+    if isinstance(meme_file, ContentFile) and settings.MEMES_HOT_CACHE_BYTES > 0:
+        # we already have the bytes, so the first view needn't read them back
+        meme_file.seek(0)
+        hot_memes.set(
+            str(meme.id),
+            HotMeme(meme_file.read(), meme.format, meme.created_at.timestamp()),
+        )
+
+
+def link_image(existing, name):
+    """Give the image called existing a second name, and return that name.
+
+    Local images are hard linked, and S3 ones copied by the server.
+    """
+    if existing != name:
+        default_storage.copy(existing, name)
+    return name
+
+
+def store_derivatives(meme, meme_file, names=None):
+    """Save a meme's derivatives next to where its image will be saved.
+
+    They're saved before the meme, so that serving never finds a meme without
+    them. meme_file is a MemeFile, or the name of an existing image whose
+    derivatives to link. Returns the names saved, which are also appended to
+    names as each is saved if it's given, so a caller can delete them if
+    saving fails partway.
+    """
+    name = meme_image_name(meme.id, OUTPUT_FORMATS[meme.format].extension)
+    if isinstance(meme_file, str):
+        return link_derivatives(meme_file, name, names)
+    return save_derivatives(name, meme_file.derivatives, names)
+
+
+def save_derivatives(name, derivatives, names=None):
+    """Save the derivatives of the image called name, and return their names."""
+    names = [] if names is None else names
+    for (width, format_name), content in derivatives.items():
+        extension = OUTPUT_FORMATS[format_name].extension
+        names.append(
+            default_storage.save(
+                meme_derivative_name(name, width, extension), ContentFile(content)
+            )
+        )
+    return names
+
+
+def link_derivatives(existing, name, names=None):
+    """Link the derivatives of the image called existing to go with name."""
+    names = [] if names is None else names
+    for width in settings.MEMES_DERIVATIVE_WIDTHS:
+        for format_name in settings.MEMES_DERIVATIVE_FORMATS:
+            extension = OUTPUT_FORMATS[format_name].extension
+            derivative = meme_derivative_name(existing, width, extension)
+            # there are none for images too small to scale down, or from
+            # before we made them
+            if default_storage.exists(derivative):
+                names.append(
+                    link_image(derivative, meme_derivative_name(name, width, extension))
+                )
+    return names
+
+
+def meme_details(request, meme):
+    details = {
+        "id": str(meme.id),
+        "image_url": request.build_absolute_uri(meme.get_image_url()),
+        "top_text": meme.top_text,
+        "bottom_text": meme.bottom_text,
+        "original_image_url": meme.image_url,
+        "format": meme.format,
+        "status": meme.status,
+        "created_at": meme.created_at.isoformat(),
+    }
+    if settings.MEMES_DERIVATIVE_WIDTHS:
+        thumb_width = min(settings.MEMES_DERIVATIVE_WIDTHS)
+        details["thumbnail_url"] = f"{details['image_url']}?w={thumb_width}"
+    if meme.status == Meme.Status.FAILED:
+        details["error"] = meme.error
+    return details
+
+
+def created_response(request, meme):
+    # everything get_meme would return, so clients needn't ask for it again
+    return JsonResponse(meme_details(request, meme), status=201)
+
+
+def accepted_response(request, meme):
+    """202 for a meme that will be rendered in the background."""
+    status_url = reverse("memes:get_meme", kwargs={"meme_id": meme.id})
+    events_url = reverse("memes:meme_events", kwargs={"meme_id": meme.id})
+    response = JsonResponse(
+        {
+            **meme_details(request, meme),
+            "status_url": request.build_absolute_uri(status_url),
+            "events_url": request.build_absolute_uri(events_url),
+        },
+        status=202,
+    )
+    response["Location"] = status_url
+    return response
+
+
+def busy_response(e):
+    response = JsonResponse({"error": f"Server busy: {str(e)}"}, status=503)
+    response["Retry-After"] = str(settings.MEMES_RENDER_RETRY_AFTER)
+    return response
+
+
+@require_http_methods(["POST"])
+def create_meme(request):
+    """JSON API endpoint to create a meme."""
     try:
-        # Generate the meme image
-        meme_file = generate_meme(image_url, top_text, bottom_text)
+        fields = parse_meme_request(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        # If we've already rendered this exact meme, point the new record at
+        # the existing file rather than fetching and rendering it again
+        meme_file = find_rendered_image(fields["content_hash"])
+
+        if meme_file is None and wants_job(request):
+            # render it in the background, and let the client poll for it
+            return accepted_response(request, queue_meme(fields))
+
+        if meme_file is None:
+            # Generate the meme image
+            meme_file = generate_meme(
+                fields["image_url"],
+                fields["top_text"],
+                fields["bottom_text"],
+                fields["format"],
+            )
 
         # Create and save the meme record
-        meme = Meme.objects.create(
-            image_url=image_url,
-            top_text=top_text,
-            bottom_text=bottom_text,
-            generated_image=meme_file,
+        meme = save_meme(fields, meme_file)
+        return created_response(request, meme)
+
+    except RenderQueueFullError as e:
+        return busy_response(e)
+    except SourceImageError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": f"Failed to generate meme: {str(e)}"}, status=500)
+
+
+@require_http_methods(["POST"])
+async def acreate_meme(request):
+    """Async version of create_meme, used when we're served over ASGI."""
+    try:
+        fields = parse_meme_request(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        meme_file = await sync_to_async(find_rendered_image)(fields["content_hash"])
+
+        if meme_file is None and wants_job(request):
+            meme = await sync_to_async(queue_meme)(fields)
+            return accepted_response(request, meme)
+
+        if meme_file is None:
+            # fetching doesn't tie up a worker, and rendering happens in the pool
+            meme_file = await agenerate_meme(
+                fields["image_url"],
+                fields["top_text"],
+                fields["bottom_text"],
+                fields["format"],
+            )
+
+        meme = await sync_to_async(save_meme)(fields, meme_file)
+        return created_response(request, meme)
+
+    except RenderQueueFullError as e:
+        return busy_response(e)
+    except SourceImageError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": f"Failed to generate meme: {str(e)}"}, status=500)
+
+
+def wants_job(request):
+    """Whether to create this meme in the background, and return 202 at once."""
+    # clients can ask for it with RFC 7240's Prefer: respond-async
+    prefer = request.headers.get("Prefer", "")
+    return settings.MEMES_JOBS or "respond-async" in prefer.lower()
+
+
+def queue_meme(fields):
+    """Save a pending Meme, and queue a job to render it."""
+    meme = Meme.objects.create(**fields, status=Meme.Status.PENDING)
+    job_queue.submit(run_meme_job, meme.id)
+    return meme
+
+
+def run_meme_job(meme_id):
+    """Fetch and render a pending meme, in a job queue thread."""
+    # claim it, in case another worker is resuming pending memes too
+    claimed = Meme.objects.filter(id=meme_id, status=Meme.Status.PENDING).update(
+        status=Meme.Status.RENDERING, started_at=timezone.now()
+    )
+    if not claimed:
+        return
+    meme = Meme.objects.get(id=meme_id)
+
+    with tracer.start_as_current_span("run_meme_job") as span:
+        span.set_attribute("meme.id", str(meme_id))
+        try:
+            for attempt in range(settings.MEMES_JOB_RETRIES + 1):
+                try:
+                    meme_file = generate_meme(
+                        meme.image_url, meme.top_text, meme.bottom_text, meme.format
+                    )
+                    break
+                except RenderQueueFullError:
+                    if attempt == settings.MEMES_JOB_RETRIES:
+                        raise
+                    time.sleep(settings.MEMES_RENDER_RETRY_AFTER)
+        except Exception as e:
+            fail_meme_job(span, meme_id, e)
+            return
+
+        written = []
+        try:
+            store_derivatives(meme, meme_file, written)
+            meme.generated_image = meme_file
+            meme.status = Meme.Status.READY
+            meme.save(update_fields=["generated_image", "status"])
+        except Exception as e:
+            for name in written:
+                default_storage.delete(name)
+            fail_meme_job(span, meme_id, f"Failed to save meme: {e}")
+            return
+        remember_hot_meme(meme, meme_file)
+
+
+def fail_meme_job(span, meme_id, error):
+    if isinstance(error, Exception):
+        span.record_exception(error)
+    Meme.objects.filter(id=meme_id).update(status=Meme.Status.FAILED, error=str(error))
+
+
+def resume_jobs():
+    """Queue memes left pending, e.g. by a worker that was restarted."""
+    # a meme still rendering this long after a job claimed it was being
+    # rendered by a worker that died, so give it another go
+    stale = timezone.now() - timedelta(seconds=settings.MEMES_JOB_TIMEOUT)
+    claimed_long_ago = Q(started_at__lt=stale) | Q(
+        # claimed before we recorded when
+        started_at__isnull=True,
+        created_at__lt=stale,
+    )
+    Meme.objects.filter(claimed_long_ago, status=Meme.Status.RENDERING).update(
+        status=Meme.Status.PENDING
+    )
+    pending = Meme.objects.filter(status=Meme.Status.PENDING)
+    meme_ids = list(pending.values_list("id", flat=True))
+    for meme_id in meme_ids:
+        job_queue.submit(run_meme_job, meme_id)
+    return len(meme_ids)
+
+
+def meme_events(request, meme_id):
+    """Server-sent events reporting a meme's status until it's ready or failed."""
+    get_object_or_404(Meme, id=meme_id)
+    events = status_events if not settings.MEMES_ASYNC else astatus_events
+    response = StreamingHttpResponse(
+        events(request, meme_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # tell nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def status_event(request, meme):
+    return f"event: status\ndata: {json.dumps(meme_details(request, meme))}\n\n"
+
+
+def status_events(request, meme_id):
+    deadline = time.monotonic() + settings.MEMES_JOB_EVENTS_TIMEOUT
+    last_status = None
+    while True:
+        meme = Meme.objects.get(id=meme_id)
+        if meme.status != last_status:
+            last_status = meme.status
+            yield status_event(request, meme)
+        if not meme.is_pending or time.monotonic() >= deadline:
+            return
+        time.sleep(settings.MEMES_JOB_POLL_INTERVAL)
+
+
+async def astatus_events(request, meme_id):
+    """Async version of status_events, which doesn't tie up an ASGI worker."""
+    deadline = time.monotonic() + settings.MEMES_JOB_EVENTS_TIMEOUT
+    last_status = None
+    while True:
+        meme = await Meme.objects.aget(id=meme_id)
+        if meme.status != last_status:
+            last_status = meme.status
+            yield status_event(request, meme)
+        if not meme.is_pending or time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(settings.MEMES_JOB_POLL_INTERVAL)
+
+
+def parse_batch_request(request):
+    """Return the list of meme specs in a batch create request."""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON")
+
+    specs = data.get("memes") if isinstance(data, dict) else data
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("memes must be a non-empty list")
+    if len(specs) > settings.MEMES_BATCH_MAX_SIZE:
+        raise ValueError(
+            f"At most {settings.MEMES_BATCH_MAX_SIZE} memes can be created at once"
         )
+    return specs
+
+
+@require_http_methods(["POST"])
+def create_memes(request):
+    """JSON API endpoint to create many memes at once.
+
+    Takes {"memes": [...]}, each item being what create_meme takes, and streams
+    back a line of JSON for each item as soon as its meme is saved, in
+    whatever order they finish, and a last line counting them up. Memes are
+    saved as their images are ready, so every id we send can be fetched.
+    """
+    try:
+        specs = parse_batch_request(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # the results are produced after we return, so keep the request's trace
+    parent = otel_context.get_current()
+    # over ASGI, Django collects a sync iterator into a list before sending any
+    # of it, so it has to be async to stream
+    results = abatch_results if settings.MEMES_ASYNC else batch_results
+    return StreamingHttpResponse(
+        results(request, specs, parent), content_type="application/x-ndjson"
+    )
+
+
+def batch_results(request, specs, parent=None):
+    """Create the memes for a batch, yielding a line for each as it's done."""
+    with tracer.start_as_current_span("batch_results", context=parent) as span:
+        span.set_attribute("batch.size", len(specs))
+        for line in create_batch(Batch(request, specs), span):
+            yield json.dumps(line) + "\n"
+
+
+async def abatch_results(request, specs, parent=None):
+    """Async version of batch_results, for the ASGI request path."""
+    with tracer.start_as_current_span("batch_results", context=parent) as span:
+        span.set_attribute("batch.size", len(specs))
+        async for line in acreate_batch(Batch(request, specs), span):
+            yield json.dumps(line) + "\n"
+
 
-        return JsonResponse(
+class Batch:
+    """The memes in a batch create request, and the lines reporting on them."""
+
+    def __init__(self, request, specs):
+        self.request = request
+        self.specs = specs
+        self.created = 0
+        # identical memes in the batch are only rendered once, so these are
+        # lists of (index, Meme) by content hash
+        self.pending = defaultdict(list)
+
+    def parse(self):
+        """Collect the valid specs in pending, and return lines for the rest."""
+        accept = self.request.headers.get("Accept", "")
+        lines = []
+        for index, spec in enumerate(self.specs):
+            try:
+                fields = parse_meme_spec(spec, accept)
+            except ValueError as e:
+                lines.append({"index": index, "error": str(e)})
+                continue
+            self.pending[fields["content_hash"]].append((index, Meme(**fields)))
+        return lines
+
+    def reuse_rendered(self):
+        """Save the memes whose images we've already rendered."""
+        lines = []
+        for content_hash, name in find_rendered_images(list(self.pending)).items():
+            lines.extend(self.finish(self.pending.pop(content_hash), name))
+        return lines
+
+    def chunks(self):
+        """The memes left to render, by source url, split into render tasks.
+
+        Each chunk is a list of lists of (index, Meme), one for each image.
+        """
+        groups = defaultdict(list)
+        for items in self.pending.values():
+            groups[items[0][1].image_url].append(items)
+        size = settings.MEMES_BATCH_CHUNK_SIZE
+        # split big groups, so they can be rendered in parallel
+        return {
+            url: [group[start : start + size] for start in range(0, len(group), size)]
+            for url, group in groups.items()
+        }
+
+    def save(self, items, rendered):
+        """Store a newly rendered image, and save the memes that use it."""
+        _, first = items[0]
+        written = []
+        try:
+            name = default_storage.save(
+                meme_image_name(first.id, OUTPUT_FORMATS[first.format].extension),
+                ContentFile(rendered.content),
+            )
+            written.append(name)
+            save_derivatives(name, rendered.derivatives, written)
+        except Exception as e:
+            return self.failed_to_save(items, written, e)
+        return self.finish(items, name, written)
+
+    def finish(self, items, name, written=()):
+        """Save a meme for each item with the image called name.
+
+        Every item gets its own name, the same image hard linked if need be,
+        and they're saved before we return their ids.
+        """
+        # as each is written, so we can delete them all if we fail partway
+        written = list(written)
+        try:
+            for _, meme in items:
+                extension = OUTPUT_FORMATS[meme.format].extension
+                image_name = meme_image_name(meme.id, extension)
+                link_derivatives(name, image_name, written)
+                meme.generated_image = link_image(name, image_name)
+                written.append(image_name)
+            with transaction.atomic():
+                Meme.objects.bulk_create([meme for _, meme in items])
+        except Exception as e:
+            return self.failed_to_save(items, written, e)
+
+        self.created += len(items)
+        return [
             {
+                "index": index,
                 "id": str(meme.id),
-                "image_url": request.build_absolute_uri(meme.get_image_url()),
-                "created_at": meme.created_at.isoformat(),
-            },
-            status=201,
-        )
+                "image_url": self.request.build_absolute_uri(meme.get_image_url()),
+                "format": meme.format,
+            }
+            for index, meme in items
+        ]
 
-    except Exception as e:
-        return JsonResponse({"error": f"Failed to generate meme: {str(e)}"}, status=500)
+    def failed_to_save(self, items, written, error):
+        # the first item's image and derivatives are already named for it, so
+        # linking them adds their names a second time
+        for name in set(written):
+            default_storage.delete(name)
+        return self.failed(items, f"Failed to save meme: {error}")
+
+    def failed(self, items, error):
+        return [{"index": index, "error": error} for index, _ in items]
+
+    def render_failed(self, chunk, e):
+        error = f"Server busy: {e}" if isinstance(e, RenderQueueFullError) else e
+        return [
+            line
+            for items in chunk
+            for line in self.failed(items, f"Failed to generate meme: {error}")
+        ]
+
+    def summary(self):
+        return {
+            "status": "complete",
+            "created": self.created,
+            "failed": len(self.specs) - self.created,
+        }
+
+
+def chunk_captions(chunk):
+    firsts = [items[0][1] for items in chunk]
+    return [(meme.top_text, meme.bottom_text, meme.format) for meme in firsts]
+
+
+def render_chunk(source, chunk):
+    """Render a chunk of a batch, retrying with backoff if the pool is full."""
+    for attempt in range(settings.MEMES_BATCH_RETRIES + 1):
+        try:
+            return render_executor.run(
+                render_memes,
+                source.url,
+                source.validator,
+                source.content,
+                chunk_captions(chunk),
+            )
+        except RenderQueueFullError:
+            if attempt == settings.MEMES_BATCH_RETRIES:
+                raise
+            time.sleep(settings.MEMES_RENDER_RETRY_AFTER * 2**attempt)
+
+
+async def arender_chunk(source, chunk):
+    """Async version of render_chunk."""
+    for attempt in range(settings.MEMES_BATCH_RETRIES + 1):
+        try:
+            return await render_executor.arun(
+                render_memes,
+                source.url,
+                source.validator,
+                source.content,
+                chunk_captions(chunk),
+            )
+        except RenderQueueFullError:
+            if attempt == settings.MEMES_BATCH_RETRIES:
+                raise
+            await asyncio.sleep(settings.MEMES_RENDER_RETRY_AFTER * 2**attempt)
+
+
+async def limited(semaphore, func, *args):
+    """Await func(*args) once semaphore lets us."""
+    async with semaphore:
+        return await func(*args)
+
+
+def create_batch(batch, span):
+    yield from batch.parse()
+    yield from batch.reuse_rendered()
+
+    # fetch each source image once, however many memes use it
+    chunks = batch.chunks()
+    span.set_attribute("batch.sources", len(chunks))
+
+    # one thread per render process, as more would only fill its queue
+    render_threads = max(render_executor.max_workers, 1)
+    with (
+        ThreadPoolExecutor(max_workers=settings.MEMES_BATCH_FETCHES) as fetcher,
+        ThreadPoolExecutor(max_workers=render_threads) as renderer,
+    ):
+        fetches = {
+            fetcher.submit(contextvars.copy_context().run, source_cache.fetch, url): url
+            for url in chunks
+        }
+        renders = {}
+        for fetch in as_completed(fetches):
+            url_chunks = chunks[fetches[fetch]]
+            try:
+                source = fetch.result()
+            except Exception as e:
+                for chunk in url_chunks:
+                    for items in chunk:
+                        yield from batch.failed(items, f"Failed to fetch image: {e}")
+                continue
+            for chunk in url_chunks:
+                future = renderer.submit(
+                    contextvars.copy_context().run, render_chunk, source, chunk
+                )
+                renders[future] = chunk
+
+        for future in as_completed(renders):
+            chunk = renders[future]
+            try:
+                contents = future.result()
+            except Exception as e:
+                yield from batch.render_failed(chunk, e)
+                continue
+            for items, rendered in zip(chunk, contents):
+                yield from batch.save(items, rendered)
+
+    yield batch.summary()
+
+
+async def acreate_batch(batch, span):
+    """Async version of create_batch."""
+    for line in await sync_to_async(batch.parse)():
+        yield line
+    for line in await sync_to_async(batch.reuse_rendered)():
+        yield line
+
+    chunks = batch.chunks()
+    span.set_attribute("batch.sources", len(chunks))
+
+    # the same limits as the threads create_batch uses
+    fetching = asyncio.Semaphore(settings.MEMES_BATCH_FETCHES)
+    rendering = asyncio.Semaphore(max(render_executor.max_workers, 1))
+    fetches = {
+        url: asyncio.ensure_future(limited(fetching, source_cache.afetch, url))
+        for url in chunks
+    }
+    renders = {}
+    try:
+        for url, url_chunks in chunks.items():
+            try:
+                source = await fetches[url]
+            except Exception as e:
+                for chunk in url_chunks:
+                    for items in chunk:
+                        for line in batch.failed(items, f"Failed to fetch image: {e}"):
+                            yield line
+                continue
+            for chunk in url_chunks:
+                task = asyncio.ensure_future(
+                    limited(rendering, arender_chunk, source, chunk)
+                )
+                renders[task] = chunk
+
+        waiting = set(renders)
+        while waiting:
+            done, waiting = await asyncio.wait(
+                waiting, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                chunk = renders[task]
+                try:
+                    contents = task.result()
+                except Exception as e:
+                    for line in batch.render_failed(chunk, e):
+                        yield line
+                    continue
+                for items, rendered in zip(chunk, contents):
+                    for line in await sync_to_async(batch.save)(items, rendered):
+                        yield line
+    finally:
+        # e.g. the client went away, so stop work nobody will see
+        for task in [*fetches.values(), *renders]:
+            task.cancel()
+
+    yield batch.summary()
+
+
+# Generated memes never change, so caches can keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def meme_etag(meme_id):
+    # a meme's image never changes once it's created, so its id is a strong ETag
+    return quote_etag(str(meme_id))
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against our ETag."""
+    etags = parse_etags(header)
+    return "*" in etags or etag in (e.removeprefix("W/") for e in etags)
+
+
+def parse_range(header, size):
+    """Parse a single range Range header into (start, end) inclusive offsets.
+
+    Returns None for anything we don't handle (which means sending the whole
+    file), and raises ValueError for a range that can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
 
 
 def serve_meme(request, meme_id):
-    """Serve the generated meme image."""
-    meme = get_object_or_404(Meme, id=meme_id)
+    """Serve the generated meme image.
 
-    if not meme.generated_image:
-        raise Http404("Image not found")
+    Images are cached by ETag, so repeat views are answered from the meme id
+    alone. Recently created and served images are sent from memory, and the
+    rest are streamed (or handed to the front proxy with MEMES_SENDFILE_HEADER).
+
+    With ?w=<width>, the nearest derivative to that width is served instead, or
+    the full size image if none are as wide.
+    """
+    if "w" in request.GET:
+        try:
+            width = int(request.GET["w"])
+        except ValueError:
+            return JsonResponse({"error": "w must be a number"}, status=400)
+        derivative = find_derivative(meme_id, width, request.headers.get("Accept", ""))
+        if derivative is not None:
+            return derivative_response(request, meme_id, *derivative)
+
+    etag = meme_etag(meme_id)
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+    elif parse_http_date_safe(request.headers.get("If-Modified-Since", "")):
+        # memes never change, so whatever copy the client has is still current
+        # (but If-None-Match takes precedence when it's sent too)
+        return not_modified_response(etag)
 
+    use_hot = use_hot_cache(request)
+    hot = hot_memes.get(str(meme_id)) if use_hot else None
+    trace.get_current_span().set_attribute("meme.hot_cache_hit", hot is not None)
     try:
-        with open(meme.generated_image.path, "rb") as f:
-            response = HttpResponse(f.read(), content_type="image/png")
-            response["Content-Disposition"] = f'inline; filename="meme_{meme.id}.png"'
-            return response
+        if hot is None:
+            located = find_meme_image(meme_id)
+            if located is None:
+                # not where its id says it should be, so it may be in the old layout
+                located = find_meme_image_in_db(meme_id)
+            name, format_name, modified = located
+            if use_hot:
+                hot = HotMeme(read_image(name), format_name, modified)
+                hot_memes.set(str(meme_id), hot)
+            else:
+                response = image_response(request, name, etag)
     except FileNotFoundError:
         raise Http404("Image file not found")
+    except MemeNotReadyError as e:
+        response = JsonResponse({"id": str(meme_id), "status": e.status}, status=202)
+        response["Retry-After"] = "1"
+        response["Cache-Control"] = "no-store"
+        return response
+
+    if hot is not None:
+        response = HttpResponse(hot.content)
+        format_name, modified = hot.format, hot.modified
+
+    extension = OUTPUT_FORMATS[format_name].extension
+    return image_headers(
+        response, f"meme_{meme_id}.{extension}", format_name, etag, modified
+    )
+
+
+def not_modified_response(etag):
+    trace.get_current_span().set_attribute("meme.not_modified", True)
+    response = HttpResponse(status=304)
+    response["ETag"] = etag
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def image_headers(response, filename, format_name, etag, modified):
+    response["Content-Type"] = OUTPUT_FORMATS[format_name].content_type
+    response["Content-Disposition"] = f'inline; filename="{filename}"'
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(modified)
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def find_derivative(meme_id, width, accept):
+    """Find the nearest derivative of a meme's image to width, from its id alone.
+
+    That's the narrowest one at least width wide, so it's never scaled up, in
+    the format the client prefers if we have it. Returns (name, width, format,
+    modified time), or None if there isn't one.
+    """
+    preferred = choose_output_format(None, accept)
+    formats = sorted(settings.MEMES_DERIVATIVE_FORMATS, key=lambda f: f != preferred)
+    # derivatives are named after the image, whichever format that's in
+    image_name = meme_image_name(meme_id, settings.MEMES_OUTPUT_FORMAT)
+    for candidate in sorted(w for w in settings.MEMES_DERIVATIVE_WIDTHS if w >= width):
+        for format_name in formats:
+            name = meme_derivative_name(
+                image_name, candidate, OUTPUT_FORMATS[format_name].extension
+            )
+            try:
+                return name, candidate, format_name, image_modified(name)
+            except FileNotFoundError:
+                continue
+    return None
+
+
+def derivative_response(request, meme_id, name, width, format_name, modified):
+    trace.get_current_span().set_attribute("meme.derivative", f"w{width}")
+    extension = OUTPUT_FORMATS[format_name].extension
+    etag = quote_etag(f"{meme_id}.w{width}.{extension}")
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        response = not_modified_response(etag)
+    else:
+        response = image_headers(
+            image_response(request, name, etag),
+            f"meme_{meme_id}.w{width}.{extension}",
+            format_name,
+            etag,
+            modified,
+        )
+    # which format we picked depends on Accept
+    response["Vary"] = "Accept"
+    return response
+
+
+def use_hot_cache(request):
+    # ranges are rare enough to always go to the disk, and a front proxy
+    # sending the file is cheaper than us sending it from memory
+    return (
+        settings.MEMES_HOT_CACHE_BYTES > 0
+        and not settings.MEMES_SENDFILE_HEADER
+        and "Range" not in request.headers
+    )
+
+
+def read_image(name):
+    with default_storage.open(name, "rb") as f:
+        return f.read()
+
+
+def find_meme_image(meme_id):
+    """Find a meme's image from its id alone, without asking the database.
+
+    Returns (name, format, modified time), or None if there's no image where
+    its id says it should be.
+    """
+    # the configured format is the most likely, so try it first
+    formats = sorted(OUTPUT_FORMATS, key=lambda f: f != settings.MEMES_OUTPUT_FORMAT)
+    for format_name in formats:
+        name = meme_image_name(meme_id, OUTPUT_FORMATS[format_name].extension)
+        try:
+            return name, format_name, image_modified(name)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def image_modified(name):
+    """When the image called name was saved, as a timestamp.
+
+    Raises FileNotFoundError if there's no such image.
+    """
+    return default_storage.get_modified_time(name).timestamp()
+
+
+class MemeNotReadyError(Exception):
+    """Raised when serving a meme that's still being rendered in the background."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def find_meme_image_in_db(meme_id):
+    """Look a meme's image up the slow way, for images not yet migrated.
+
+    Raises MemeNotReadyError for memes still pending, rather than waiting for
+    them and tying up the worker, so clients get a 202 to retry straight away.
+    """
+    meme = get_object_or_404(Meme, id=meme_id)
+    if meme.is_pending:
+        raise MemeNotReadyError(meme.status)
+    if not meme.generated_image:
+        raise Http404("Image not found")
+    return meme.generated_image.name, meme.format, meme.created_at.timestamp()
+
+
+def image_response(request, name, etag):
+    """A response with the body of the image called name, or the range asked for."""
+    # the front proxy can only send images that are files on this host
+    path = default_storage.local_path(name) if settings.MEMES_SENDFILE_HEADER else None
+    if path and settings.MEMES_SENDFILE_HEADER == "X-Accel-Redirect":
+        # nginx serves the file, and handles ranges, from an internal location
+        # that maps to MEDIA_ROOT, which the spool is in too
+        relative = os.path.relpath(path, settings.MEDIA_ROOT)
+        response = HttpResponse()
+        response["X-Accel-Redirect"] = settings.MEMES_ACCEL_REDIRECT_PREFIX + relative
+        return response
+    if path:
+        response = HttpResponse()
+        response[settings.MEMES_SENDFILE_HEADER] = path
+        return response
+
+    f = default_storage.open(name, "rb")
+    size = f.size
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            f.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            with f:
+                f.seek(start)
+                response = HttpResponse(f.read(end - start + 1), status=206)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return response
+
+    # FileResponse streams the file, and gunicorn uses sendfile() for local ones
+    response = FileResponse(f)
+    response["Accept-Ranges"] = "bytes"
+    return response
 
 
 def get_meme(request, meme_id):
     """Get meme details by ID."""
     meme = get_object_or_404(Meme, id=meme_id)
+    return JsonResponse(meme_details(request, meme))
+
+
+# just what meme_details needs, so listing doesn't load content hashes etc.
+LIST_FIELDS = [
+    "id",
+    "image_url",
+    "top_text",
+    "bottom_text",
+    "format",
+    "status",
+    "error",
+    "created_at",
+]
+
+
+def encode_cursor(meme):
+    """An opaque cursor for the page of memes after this one."""
+    position = f"{meme.created_at.isoformat()}|{meme.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, id) a cursor points at.
+
+    Raises ValueError if it isn't one of ours.
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, meme_id = position.decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(meme_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def memes_after(memes, cursor):
+    """Memes that come after cursor in newest first order.
+
+    Rather than OFFSET, which has to step over every meme on the pages before,
+    this seeks straight to the cursor in the (created_at, id) index, so the
+    last page is as quick as the first.
+    """
+    created_at, meme_id = decode_cursor(cursor)
+    # the created_at__lte is redundant, but it's what lets SQLite use the
+    # index for a range, rather than filtering the whole table by the OR
+    return memes.filter(created_at__lte=created_at).filter(
+        Q(created_at__lt=created_at) | Q(id__lt=meme_id)
+    )
+
+
+def parse_page_size(value):
+    if value is None:
+        return settings.MEMES_LIST_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if not 1 <= limit <= settings.MEMES_LIST_MAX_PAGE_SIZE:
+        raise ValueError(
+            f"limit must be between 1 and {settings.MEMES_LIST_MAX_PAGE_SIZE}"
+        )
+    return limit
+
+
+@require_http_methods(["GET"])
+def list_memes(request):
+    """List memes, newest first, a page at a time.
+
+    Optionally filtered to one image_url, and/or to memes with a top or
+    bottom caption starting with caption. Follow "next" for the next page,
+    which is null on the last one.
+    """
+    try:
+        limit = parse_page_size(request.GET.get("limit"))
+        memes = Meme.objects.only(*LIST_FIELDS).order_by("-created_at", "-id")
+        if image_url := request.GET.get("image_url"):
+            memes = memes.filter(image_url=image_url)
+        if caption := request.GET.get("caption"):
+            memes = memes.filter(
+                Q(top_text__startswith=caption) | Q(bottom_text__startswith=caption)
+            )
+        if cursor := request.GET.get("cursor"):
+            memes = memes_after(memes, cursor)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # one extra, to tell whether there's another page
+    page = list(memes[: limit + 1])
+    next_url = None
+    if len(page) > limit:
+        page = page[:limit]
+        query = request.GET.copy()
+        query["cursor"] = encode_cursor(page[-1])
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+    return JsonResponse(
+        {
+            "results": [meme_details(request, meme) for meme in page],
+            "next": next_url,
+        }
+    )
+
 
+def stats(request):
+    """Report this worker's cache counters."""
+    caches = cache_stats()
+    # with a render pool, the render caches that count are the pool's
+    caches.update(render_executor.pool_cache_stats())
     return JsonResponse(
         {
-            "id": str(meme.id),
-            "image_url": request.build_absolute_uri(meme.get_image_url()),
-            "top_text": meme.top_text,
-            "bottom_text": meme.bottom_text,
-            "original_image_url": meme.image_url,
-            "created_at": meme.created_at.isoformat(),
+            "pid": os.getpid(),
+            "mode": "asgi" if settings.MEMES_ASYNC else "wsgi",
+            "caches": caches,
         }
     )
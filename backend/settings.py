@@ -59,20 +59,35 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "wsgi.application"
+ASGI_APPLICATION = "asgi.application"
+
+# Use the async request path. asgi.py always turns this on.
+MEMES_ASYNC = os.environ.get("MEMES_ASYNC", "false").lower() == "true"
 
 # Database
 # SQLite with WAL mode for concurrent access
+# How long (in ms) to let one write transaction wait for another
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", "5000"))
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # keep each worker's connection open between requests, so we don't
+        # reconnect and rerun the PRAGMAs below every time
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
         "OPTIONS": {
-            "init_command": """
+            # take the write lock at the start of a transaction, rather than
+            # when it first writes. Upgrading a read lock fails straight away
+            # with "database is locked" if another worker wrote in between,
+            # whereas waiting for the write lock honours busy_timeout
+            "transaction_mode": "IMMEDIATE",
+            "init_command": f"""
                 PRAGMA journal_mode=WAL;
                 PRAGMA synchronous=NORMAL;
                 PRAGMA foreign_keys = ON;
-                /* How long (in ms) to let one write transaction wait for another */
-                PRAGMA busy_timeout = 5000;
+                PRAGMA busy_timeout = {DB_BUSY_TIMEOUT};
                 PRAGMA cache_size=1000;
                 PRAGMA temp_store=memory;
                 PRAGMA mmap_size=128000000;
@@ -107,6 +122,183 @@ USE_TZ = True
 # Media files for uploaded images
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Where meme images are kept (see memes.storage): "local", under MEDIA_ROOT,
+# or "s3", in the S3-compatible bucket below
+MEMES_STORAGE = os.environ.get("MEMES_STORAGE", "local")
+MEMES_S3_BUCKET = os.environ.get("MEMES_S3_BUCKET", "memes")
+MEMES_S3_ENDPOINT_URL = os.environ.get("MEMES_S3_ENDPOINT_URL", "http://localhost:9000")
+MEMES_S3_REGION = os.environ.get("MEMES_S3_REGION", "us-east-1")
+MEMES_S3_ACCESS_KEY_ID = os.environ.get("MEMES_S3_ACCESS_KEY_ID", "")
+MEMES_S3_SECRET_ACCESS_KEY = os.environ.get("MEMES_S3_SECRET_ACCESS_KEY", "")
+# Save images to a spool on the local disk and store them in the background,
+# so creating a meme doesn't wait for the storage
+MEMES_STORAGE_WRITE_BEHIND = (
+    os.environ.get("MEMES_STORAGE_WRITE_BEHIND", "true").lower() == "true"
+)
+MEMES_STORAGE_SPOOL_DIR = MEDIA_ROOT / "spool"
+# Threads per worker storing spooled images, and how many times each retries
+MEMES_STORAGE_UPLOAD_WORKERS = int(os.environ.get("MEMES_STORAGE_UPLOAD_WORKERS", "4"))
+MEMES_STORAGE_UPLOAD_RETRIES = int(os.environ.get("MEMES_STORAGE_UPLOAD_RETRIES", "3"))
+
+if MEMES_STORAGE == "s3":
+    MEMES_STORAGE_BACKEND = {
+        "BACKEND": "memes.storage.S3Storage",
+        "OPTIONS": {
+            "bucket": MEMES_S3_BUCKET,
+            "endpoint_url": MEMES_S3_ENDPOINT_URL,
+            "region": MEMES_S3_REGION,
+            "access_key_id": MEMES_S3_ACCESS_KEY_ID,
+            "secret_access_key": MEMES_S3_SECRET_ACCESS_KEY,
+        },
+    }
+else:
+    MEMES_STORAGE_BACKEND = {"BACKEND": "memes.storage.LocalStorage"}
+
+STORAGES = {
+    "default": {
+        "BACKEND": "memes.storage.WriteBehindStorage",
+        "OPTIONS": {
+            "backend": MEMES_STORAGE_BACKEND,
+            "spool_dir": MEMES_STORAGE_SPOOL_DIR,
+            "upload_workers": MEMES_STORAGE_UPLOAD_WORKERS,
+            "upload_retries": MEMES_STORAGE_UPLOAD_RETRIES,
+        },
+    }
+    if MEMES_STORAGE_WRITE_BEHIND
+    else MEMES_STORAGE_BACKEND,
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Meme rendering
+# How many loaded fonts (one per point size) each worker keeps around
+MEMES_FONT_CACHE_SIZE = int(os.environ.get("MEMES_FONT_CACHE_SIZE", "64"))
+# Font sizes to pre-load when a gunicorn worker starts
+MEMES_FONT_WARM_SIZES = [40]
+# How caption outlines are drawn: "stroke" rasterises each caption once with a
+# FreeType stroke, "legacy" redraws the caption at every offset around it
+MEMES_OUTLINE_RENDERER = os.environ.get("MEMES_OUTLINE_RENDERER", "stroke")
+# Reuse the already rendered image when the same meme is requested again
+MEMES_DEDUPE = os.environ.get("MEMES_DEDUPE", "true").lower() == "true"
+# Source images are cached in memory, up to this many bytes per worker...
+MEMES_SOURCE_CACHE_BYTES = int(
+    os.environ.get("MEMES_SOURCE_CACHE_BYTES", str(64 * 1024 * 1024))
+)
+# ...and on disk here, shared by all workers. Set to None to disable.
+MEMES_SOURCE_CACHE_DIR = MEDIA_ROOT / "sources"
+# up to about this many bytes, dropping the least recently used beyond that
+MEMES_SOURCE_CACHE_DISK_BYTES = int(
+    os.environ.get("MEMES_SOURCE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))
+)
+# Refuse source images bigger than this many bytes, or pixels, without
+# downloading any more of them than we need to tell
+MEMES_SOURCE_MAX_BYTES = int(
+    os.environ.get("MEMES_SOURCE_MAX_BYTES", str(20 * 1024 * 1024))
+)
+MEMES_SOURCE_MAX_PIXELS = int(
+    os.environ.get("MEMES_SOURCE_MAX_PIXELS", str(40_000_000))
+)
+# Decoded, RGB converted templates kept in memory per worker, in bytes
+MEMES_BASE_IMAGE_CACHE_BYTES = int(
+    os.environ.get("MEMES_BASE_IMAGE_CACHE_BYTES", str(128 * 1024 * 1024))
+)
+# Job mode: create memes in the background, returning 202 straight away.
+# Clients can also ask for it per request with "Prefer: respond-async"
+MEMES_JOBS = os.environ.get("MEMES_JOBS", "false").lower() == "true"
+# threads per worker fetching and rendering memes in the background
+MEMES_JOB_WORKERS = int(os.environ.get("MEMES_JOB_WORKERS", "4"))
+# times a job retries when the render pool is full
+MEMES_JOB_RETRIES = 3
+# seconds between checks on a pending meme's status
+MEMES_JOB_POLL_INTERVAL = 0.2
+# how long a status event stream stays open
+MEMES_JOB_EVENTS_TIMEOUT = float(os.environ.get("MEMES_JOB_EVENTS_TIMEOUT", "60"))
+# memes still rendering this many seconds after a job claimed them are retried
+MEMES_JOB_TIMEOUT = int(os.environ.get("MEMES_JOB_TIMEOUT", "300"))
+# Most memes one /api/create/batch/ request can create...
+MEMES_BATCH_MAX_SIZE = int(os.environ.get("MEMES_BATCH_MAX_SIZE", "100"))
+# ...and how many memes on the same source image each render pool task draws
+MEMES_BATCH_CHUNK_SIZE = int(os.environ.get("MEMES_BATCH_CHUNK_SIZE", "4"))
+# times a batch render is retried when the render pool is full, waiting
+# MEMES_RENDER_RETRY_AFTER seconds the first time and doubling it each time
+MEMES_BATCH_RETRIES = int(os.environ.get("MEMES_BATCH_RETRIES", "3"))
+# Source images one batch fetches at once. Its renders are limited by the
+# render pool instead, MEMES_RENDER_WORKERS at a time.
+MEMES_BATCH_FETCHES = int(os.environ.get("MEMES_BATCH_FETCHES", "8"))
+# How many memes a page of /api/memes/ has by default, and at most
+MEMES_LIST_PAGE_SIZE = int(os.environ.get("MEMES_LIST_PAGE_SIZE", "50"))
+MEMES_LIST_MAX_PAGE_SIZE = int(os.environ.get("MEMES_LIST_MAX_PAGE_SIZE", "200"))
+# Let the front proxy send meme images: "X-Sendfile" (apache, lighttpd) sends
+# the file's path, "X-Accel-Redirect" (nginx) sends the prefix below plus the
+# file's name under MEDIA_ROOT, which should map to an internal location
+MEMES_SENDFILE_HEADER = os.environ.get("MEMES_SENDFILE_HEADER") or None
+MEMES_ACCEL_REDIRECT_PREFIX = os.environ.get(
+    "MEMES_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+)
+# Recently created and served meme images kept in memory per worker, in bytes
+# (0 to always stream them from disk), and for how many seconds
+MEMES_HOT_CACHE_BYTES = int(
+    os.environ.get("MEMES_HOT_CACHE_BYTES", str(32 * 1024 * 1024))
+)
+MEMES_HOT_CACHE_TTL = int(os.environ.get("MEMES_HOT_CACHE_TTL", "300"))
+# Source images bigger than this in either dimension are scaled down to fit
+# before we draw on them, so we don't render huge photos at full size. 0 for
+# no limit.
+MEMES_MAX_OUTPUT_SIZE = int(os.environ.get("MEMES_MAX_OUTPUT_SIZE", "1600"))
+# How many caption layouts (font size and positions) each worker remembers
+MEMES_LAYOUT_CACHE_SIZE = int(os.environ.get("MEMES_LAYOUT_CACHE_SIZE", "1024"))
+# Name of a cache in CACHES to also share layouts between workers, e.g. "shared"
+MEMES_LAYOUT_SHARED_CACHE = os.environ.get("MEMES_LAYOUT_SHARED_CACHE") or None
+# Cache rasterised captions and composite them, rather than drawing each time
+MEMES_OVERLAY_CACHE = os.environ.get("MEMES_OVERLAY_CACHE", "false").lower() == "true"
+MEMES_OVERLAY_CACHE_BYTES = int(
+    os.environ.get("MEMES_OVERLAY_CACHE_BYTES", str(32 * 1024 * 1024))
+)
+# Format used when the request doesn't ask for one: png, webp or jpeg
+MEMES_OUTPUT_FORMAT = os.environ.get("MEMES_OUTPUT_FORMAT", "png")
+# Smaller copies of each meme rendered along with it, for previews, served by
+# /images/<id>/?w=<width>: comma separated widths (thumb and medium by default,
+# empty for none), each encoded in every one of the formats
+MEMES_DERIVATIVE_WIDTHS = [
+    int(width)
+    for width in os.environ.get("MEMES_DERIVATIVE_WIDTHS", "200,600").split(",")
+    if width.strip()
+]
+MEMES_DERIVATIVE_FORMATS = [
+    name.strip()
+    for name in os.environ.get("MEMES_DERIVATIVE_FORMATS", "webp,png").split(",")
+    if name.strip()
+]
+# zlib level 0-9. Lower is much faster for slightly bigger files
+MEMES_PNG_COMPRESS_LEVEL = int(os.environ.get("MEMES_PNG_COMPRESS_LEVEL", "6"))
+MEMES_PNG_OPTIMIZE = os.environ.get("MEMES_PNG_OPTIMIZE", "false").lower() == "true"
+MEMES_WEBP_QUALITY = int(os.environ.get("MEMES_WEBP_QUALITY", "80"))
+MEMES_JPEG_QUALITY = int(os.environ.get("MEMES_JPEG_QUALITY", "85"))
+# gunicorn workers per host, as set in gunicorn.conf.py
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "4"))
+# Processes each worker renders memes in. 0 renders in the request worker
+# itself. By default the workers share out the CPUs between them
+MEMES_RENDER_WORKERS = int(
+    os.environ.get(
+        "MEMES_RENDER_WORKERS", str(max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1))
+    )
+)
+# Renders that can wait for a free process before we start returning 503s
+MEMES_RENDER_QUEUE_SIZE = int(os.environ.get("MEMES_RENDER_QUEUE_SIZE", "8"))
+# Seconds clients are told to wait before retrying when the queue is full
+MEMES_RENDER_RETRY_AFTER = int(os.environ.get("MEMES_RENDER_RETRY_AFTER", "2"))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # on disk, so visible to every gunicorn worker
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    },
+}
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -1,9 +1,9 @@
 import time
-from memes.utils import httpx_client
+from client import httpx_client
 
 
 def test_url(url):
-    """Test a single HTTP request and report timing using memes.utils client."""
+    """Test a single HTTP request and report timing using the shared client."""
     print(f"Testing URL: {url}")
 
     # Check if patch was applied
@@ -1,3 +1,4 @@
+import logging
 import os
 from opentelemetry import trace
 from opentelemetry.sdk.resources import Resource
@@ -5,12 +6,19 @@ from opentelemetry.sdk.trace import TracerProvider, export
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 
 
-def setup_tracing(server, worker):
-    """Set up otel provider and exporters."""
+def setup_tracing(server=None, worker=None):
+    """Set up otel provider and exporters, and return the provider.
+
+    Called from gunicorn's post_fork, and without a server or worker from each
+    render pool process.
+    """
 
     # do not export backend telemetry initially for pedagological purposes
     if "ENABLE_BACKEND_TELEMETRY" not in os.environ:
-        return
+        return None
+
+    log = server.log if server else logging.getLogger(__name__)
+    pid = worker.pid if worker else os.getpid()
 
     # Create a resource with service information
     resource = Resource.create({"service.name": "memes.backend"})
@@ -23,8 +31,9 @@ def setup_tracing(server, worker):
     if traces_exporter == "console":
         console_exporter = export.ConsoleSpanExporter()
         provider.add_span_processor(export.SimpleSpanProcessor(console_exporter))
-        server.log.info(f"Set up console exporter for worker {worker.pid}")
+        log.info(f"Set up console exporter for worker {pid}")
     elif traces_exporter == "otlp" and "OTEL_EXPORTER_OTLP_HEADERS" in os.environ:
         otlp_exporter = OTLPSpanExporter()
         provider.add_span_processor(export.BatchSpanProcessor(otlp_exporter))
-        server.log.info(f"Set up OTLP exporter for worker {worker.pid}")
+        log.info(f"Set up OTLP exporter for worker {pid}")
+    return provider
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the meme_generator view, with the backend stubbed out.
+
+Times the view in process, so it measures just the frontend's own work:
+loading test data, rendering the template, and the (stubbed) backend calls.
+The "cold" runs throw away the parsed test data before every request, which
+is what each request used to pay for. Compiled templates are kept in both, as
+Django's default cached template loader already does that.
+
+    uv run python bench_views.py
+    uv run python bench_views.py -n 2000
+"""
+
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import httpx  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+import client  # noqa: E402
+import views  # noqa: E402
+
+MEME_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def stub_backend(request):
+    """Answer the frontend's API calls like the backend would, instantly"""
+    if request.url.path == "/api/create/":
+        data = json.loads(request.content)
+        return httpx.Response(
+            201,
+            json={"id": MEME_ID, "original_image_url": data["image_url"], **data},
+        )
+    return httpx.Response(
+        200,
+        json={
+            "id": MEME_ID,
+            "original_image_url": "https://example.com/template.png",
+            "top_text": "ONE DOES NOT SIMPLY",
+            "bottom_text": "STUB THE BACKEND",
+        },
+    )
+
+
+def clear_caches():
+    views._test_data_cache = (None, views.DEFAULT_TEST_DATA)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    client.httpx_client._transport = httpx.MockTransport(stub_backend)
+    factory = RequestFactory()
+    cases = {
+        "form": lambda: factory.get("/"),
+        "result": lambda: factory.get(f"/?meme_id={MEME_ID}"),
+        "create": lambda: factory.post(
+            "/",
+            {
+                "image_url": "https://example.com/template.png",
+                "top_text": "ONE DOES NOT SIMPLY",
+                "bottom_text": "STUB THE BACKEND",
+            },
+        ),
+    }
+
+    print(f"{'request':>8} {'cold':>10} {'cached':>10} {'speedup':>8}")
+    for name, make_request in cases.items():
+        timings = {}
+        for mode in ("cold", "cached"):
+            clear_caches()
+            elapsed = 0.0
+            for _ in range(args.requests):
+                request = make_request()
+                if mode == "cold":
+                    clear_caches()
+                start = time.perf_counter()
+                views.meme_generator(request)
+                elapsed += time.perf_counter() - start
+            timings[mode] = elapsed / args.requests
+        print(
+            f"{name:>8} {timings['cold'] * 1000:>8.3f}ms "
+            f"{timings['cached'] * 1000:>8.3f}ms "
+            f"{timings['cold'] / timings['cached']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,25 @@
 HTTP client configuration with connection pooling for frontend.
 
 This module creates a global httpx client and provides connection warming functionality.
+Each gunicorn worker imports it after forking, so gets its own pool.
+
+Connections are only reused when the backend keeps them alive, i.e. when it runs
+on uvicorn workers (`just run-asgi`). Its default sync workers close every
+connection, so there the pool saves nothing over a client per request.
 """
 
 import httpx
 import logging
 
+from django.conf import settings
+
 # Global HTTP client with connection pooling for frontend requests
 httpx_client = httpx.Client(
-    timeout=15.0,
+    timeout=settings.BACKEND_TIMEOUT,
     limits=httpx.Limits(
-        max_keepalive_connections=10,
-        max_connections=20,
-        keepalive_expiry=120.0,  # 2 minutes to keep connections alive longer
+        max_keepalive_connections=settings.BACKEND_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections=settings.BACKEND_MAX_CONNECTIONS,
+        keepalive_expiry=settings.BACKEND_KEEPALIVE_EXPIRY,
     ),
 )
 
@@ -21,8 +28,6 @@ httpx_client = httpx.Client(
 def warm_backend_connection():
     """Make a speculative connection to the backend to warm up the connection pool."""
     try:
-        from django.conf import settings
-
         # Make a quick HEAD request to warm up the connection
         backend_url = settings.BACKEND_URL
         warmup_response = httpx_client.head(f"{backend_url}/", timeout=5.0)
@@ -88,5 +88,10 @@ def post_fork(server, worker):
     """Gunicorn hook that is called after a new worker process is started."""
     # Reload .env file to pick up any changes - this is a convenience for the workshop
     load_dotenv(".env", override=True)
+    # open a connection to the backend now, so the first request can reuse it
+    # (if the backend keeps it alive, see client.py)
+    from client import warm_backend_connection
+
+    warm_backend_connection()
     # setup our tracing in the new worker process
     setup_tracing(server, worker)
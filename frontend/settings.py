@@ -94,6 +94,19 @@ else:
     # Local development or custom environment
     BACKEND_URL = os.environ.get("BACKEND_URL", "http://127.0.0.1:8001")
 
+# Each worker keeps a pool of keep-alive connections to the backend
+BACKEND_MAX_CONNECTIONS = int(os.environ.get("BACKEND_MAX_CONNECTIONS", "20"))
+BACKEND_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("BACKEND_MAX_KEEPALIVE_CONNECTIONS", "10")
+)
+# seconds an idle connection is kept before we close it
+BACKEND_KEEPALIVE_EXPIRY = float(os.environ.get("BACKEND_KEEPALIVE_EXPIRY", "120"))
+BACKEND_TIMEOUT = float(os.environ.get("BACKEND_TIMEOUT", "15"))
+# After creating a meme we redirect to its page, carrying what the page shows
+# in a signed cookie that lasts this many seconds, rather than asking the
+# backend for it again
+MEME_RESULT_COOKIE_MAX_AGE = int(os.environ.get("MEME_RESULT_COOKIE_MAX_AGE", "60"))
+
 # Logging configuration to see HTTP requests to backend
 LOGGING = {
     "version": 1,
@@ -64,6 +64,14 @@ def extract_meme_url_from_html(html_content):
     if match:
         return match.group(1)
 
+    # Or the placeholder shown while the backend renders it in the background
+    pending_pattern = (
+        r'<div[^>]*class=["\']meme-pending["\'][^>]*data-src=["\']([^"\']+)["\']'
+    )
+    match = re.search(pending_pattern, html_content)
+    if match:
+        return match.group(1)
+
     # Look for any img tags with /images/ URLs
     img_pattern = r'<img[^>]*src=["\']([^"\']*/?images/[^"\']*\.[^"\']*)["\']'
     match = re.search(img_pattern, html_content)
@@ -111,8 +119,11 @@ def extract_error_from_html(html_content):
     return None
 
 
-async def test_meme_creation_async(semaphore, base_url, meme_data, index):
-    """Test creating a single meme through the web interface (async version)"""
+async def test_meme_creation_async(semaphore, base_url, meme_data, index, latencies):
+    """Test creating a single meme through the web interface (async version)
+
+    The time taken by successful requests is appended to latencies.
+    """
     async with semaphore:  # Limit concurrent requests
         try:
             # Disable httpx logging for this test
@@ -129,9 +140,11 @@ async def test_meme_creation_async(semaphore, base_url, meme_data, index):
             }
 
             # Follow redirects to get the success page
+            start_time = time.perf_counter()
             create_response = await client.post(
                 base_url, data=form_data, follow_redirects=True
             )
+            latency = time.perf_counter() - start_time
 
             # Check for HTTP errors and print debug info if needed
             if create_response.status_code != 200:
@@ -179,6 +192,7 @@ async def test_meme_creation_async(semaphore, base_url, meme_data, index):
                     return False
 
             # Success - print one line summary (no image fetch)
+            latencies.append(latency)
             print(
                 f"✅ Test {index + 1}: {meme_data['top_text'][:30]}... -> {meme_image_url}"
             )
@@ -202,7 +216,7 @@ async def test_meme_creation_async(semaphore, base_url, meme_data, index):
             return False
 
 
-async def run_parallel_tests(test_data, frontend_url, num_tests):
+async def run_parallel_tests(test_data, frontend_url, num_tests, latencies):
     """Run all tests in parallel with limited concurrency"""
     # Create test list by randomly selecting from test data
     expanded_tests = []
@@ -222,7 +236,9 @@ async def run_parallel_tests(test_data, frontend_url, num_tests):
     # Create tasks for all tests
     tasks = []
     for i, meme_data in enumerate(expanded_tests):
-        task = test_meme_creation_async(semaphore, frontend_url, meme_data, i)
+        task = test_meme_creation_async(
+            semaphore, frontend_url, meme_data, i, latencies
+        )
         tasks.append(task)
 
     # Run all tasks concurrently (but limited by semaphore)
@@ -233,10 +249,31 @@ async def run_parallel_tests(test_data, frontend_url, num_tests):
     return passed, len(expanded_tests)
 
 
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def get_backend_mode(backend_url):
+    """Ask the backend whether it is running its sync (wsgi) or async (asgi) path"""
+    try:
+        response = httpx.get(urljoin(backend_url, "/api/stats/"), timeout=5.0)
+        return response.json().get("mode", "unknown")
+    except (httpx.HTTPError, json.JSONDecodeError):
+        return "unknown"
+
+
 def main():
     """Run the system test"""
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Meme Generator System Test")
+    parser.add_argument(
+        "--backend-url",
+        default="http://127.0.0.1:8001",
+        help="Backend URL, used to report which mode (wsgi/asgi) it is running in",
+    )
     parser.add_argument(
         "-n",
         "--num-tests",
@@ -259,6 +296,9 @@ def main():
         frontend_url = "http://127.0.0.1:8000"
         print("Using local development URLs")
 
+    backend_mode = get_backend_mode(args.backend_url)
+    print(f"Backend mode: {backend_mode}")
+
     # Load test data
     try:
         test_data = load_test_data()
@@ -269,8 +309,9 @@ def main():
 
     # Run tests in parallel
     start_time = time.time()
+    latencies = []
     passed, total = asyncio.run(
-        run_parallel_tests(test_data, frontend_url, args.num_tests)
+        run_parallel_tests(test_data, frontend_url, args.num_tests, latencies)
     )
 
     end_time = time.time()
@@ -280,6 +321,15 @@ def main():
     print(f"Passed: {passed}/{total}")
     print(f"Failed: {total - passed}/{total}")
     print(f"Time taken: {end_time - start_time:.2f}s")
+    print(f"Throughput ({backend_mode}): {total / (end_time - start_time):.2f} memes/s")
+    if latencies:
+        print(
+            "Latency: "
+            + ", ".join(
+                f"p{p} {percentile(latencies, p) * 1000:.0f}ms" for p in (50, 90, 99)
+            )
+            + f", max {max(latencies) * 1000:.0f}ms"
+        )
 
     if passed == total:
         print("🎉 All tests passed!")
@@ -1,4 +1,5 @@
 import json
+import os
 import random
 import httpx
 from django.shortcuts import render, redirect
@@ -7,9 +8,15 @@ from django.conf import settings
 from urllib.parse import urlparse, urljoin
 from pathlib import Path
 
+from client import httpx_client
 
-def get_client():
-    return httpx.Client(timeout=15.0)
+# signed cookie holding the meme we've just created, for the page we redirect to
+RESULT_COOKIE = "meme_result"
+
+# statuses of a meme the backend is still rendering in the background
+PENDING_STATUSES = ("pending", "rendering")
+# how often the result page reloads itself while we wait for one of those
+PENDING_REFRESH_SECONDS = 1
 
 
 def is_valid_url(url: str) -> bool:
@@ -21,21 +28,37 @@ def is_valid_url(url: str) -> bool:
         return False
 
 
+TEST_DATA_PATH = Path(__file__).parent / "test-data.json"
+# Fallback to hardcoded default if file not found or invalid
+DEFAULT_TEST_DATA = (
+    {
+        "image_url": "https://cdn-useast1.kapwing.com/static/templates/x-x-everywhere-meme-template-full-96173e84.webp",
+        "top_text": "SPANS",
+        "bottom_text": "SPANS EVERYWHERE",
+    },
+)
+# (mtime, memes) of the last time we read test-data.json in this process
+_test_data_cache = (None, DEFAULT_TEST_DATA)
+
+
 def load_test_data():
-    """Load test data from test-data.json"""
-    test_data_path = Path(__file__).parent / "test-data.json"
+    """Load test data from test-data.json, only re-reading it when it changes"""
+    global _test_data_cache
     try:
-        with open(test_data_path) as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Fallback to hardcoded default if file not found or invalid
-        return [
-            {
-                "image_url": "https://cdn-useast1.kapwing.com/static/templates/x-x-everywhere-meme-template-full-96173e84.webp",
-                "top_text": "SPANS",
-                "bottom_text": "SPANS EVERYWHERE",
-            }
-        ]
+        mtime = os.stat(TEST_DATA_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return DEFAULT_TEST_DATA
+
+    cached_mtime, test_data = _test_data_cache
+    if mtime != cached_mtime:
+        try:
+            with open(TEST_DATA_PATH) as f:
+                # a tuple, so random.choice can pick from it as it is
+                test_data = tuple(json.load(f)) or DEFAULT_TEST_DATA
+        except json.JSONDecodeError:
+            test_data = DEFAULT_TEST_DATA
+        _test_data_cache = (mtime, test_data)
+    return test_data
 
 
 def get_random_default_data():
@@ -44,6 +67,43 @@ def get_random_default_data():
     return random.choice(test_data)
 
 
+def remember_result(response: HttpResponse, result: dict) -> None:
+    """Keep the details of a meme we've just created for the page we redirect to."""
+    response.set_signed_cookie(
+        RESULT_COOKIE,
+        json.dumps(
+            {
+                "id": result["id"],
+                "original_image_url": result.get("original_image_url", ""),
+                "top_text": result.get("top_text", ""),
+                "bottom_text": result.get("bottom_text", ""),
+                "status": result.get("status", "ready"),
+            }
+        ),
+        salt=RESULT_COOKIE,
+        max_age=settings.MEME_RESULT_COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def recall_result(request: HttpRequest, meme_id: str) -> dict | None:
+    """Details of meme_id from the result cookie, if it's the one we just created."""
+    value = request.get_signed_cookie(
+        RESULT_COOKIE,
+        default=None,
+        salt=RESULT_COOKIE,
+        max_age=settings.MEME_RESULT_COOKIE_MAX_AGE,
+    )
+    if value is None:
+        return None
+    try:
+        result = json.loads(value)
+    except json.JSONDecodeError:
+        return None
+    return result if result.get("id") == meme_id else None
+
+
 def meme_generator(request: HttpRequest) -> HttpResponse:
     """View for the meme generator form and preview."""
     errors = []
@@ -51,6 +111,7 @@ def meme_generator(request: HttpRequest) -> HttpResponse:
     default_form_data = get_random_default_data()
     form_data = default_form_data.copy()
     meme_image_url = None
+    meme_pending = False
 
     if request.method == "POST":
         # Get form data
@@ -90,19 +151,22 @@ def meme_generator(request: HttpRequest) -> HttpResponse:
                 # Make request to backend memes API
                 api_url = urljoin(settings.BACKEND_URL, "/api/create/")
 
-                with get_client() as client:
-                    response = client.post(
-                        api_url,
-                        json=api_data,
-                        headers={"Content-Type": "application/json"},
-                    )
+                response = httpx_client.post(
+                    api_url,
+                    json=api_data,
+                    headers={"Content-Type": "application/json"},
+                )
 
-                if response.status_code == 201:
+                # 202 means the backend is still rendering it, which the result
+                # page waits for
+                if response.status_code in (201, 202):
                     # Success - extract meme ID and redirect to GET with query param
                     result = response.json()
                     meme_id = result.get("id")
                     if meme_id:
-                        return redirect(f"/?meme_id={meme_id}")
+                        redirect_response = redirect(f"/?meme_id={meme_id}")
+                        remember_result(redirect_response, result)
+                        return redirect_response
                 else:
                     # API returned an error
                     try:
@@ -132,22 +196,35 @@ def meme_generator(request: HttpRequest) -> HttpResponse:
                 # Construct meme image URL directly using the backend URL and meme ID
                 meme_image_url = urljoin(settings.BACKEND_URL, f"/images/{meme_id}/")
 
-                # Get meme details to populate form
-                api_url = urljoin(settings.BACKEND_URL, f"/api/meme/{meme_id}/")
-                with get_client() as client:
-                    response = client.get(api_url)
+                # Get meme details to populate form, from the cookie if we've
+                # just created it, otherwise from the backend, which we also
+                # ask while it's rendering to see whether it's finished yet
+                result = recall_result(request, meme_id)
+                if result is None or result.get("status") in PENDING_STATUSES:
+                    api_url = urljoin(settings.BACKEND_URL, f"/api/meme/{meme_id}/")
+                    response = httpx_client.get(api_url)
+                    if response.status_code == 200:
+                        result = response.json()
+                    else:
+                        errors.append(
+                            f"Could not load meme details (HTTP {response.status_code})"
+                        )
 
-                if response.status_code == 200:
-                    result = response.json()
+                if result is not None:
+                    status = result.get("status")
+                    if status in PENDING_STATUSES:
+                        # the image url would only give us a 202 for now
+                        meme_pending = True
+                    elif status == "failed":
+                        errors.append(
+                            f"Failed to generate meme: {result.get('error', 'unknown error')}"
+                        )
+                        meme_image_url = None
                     form_data = {
                         "image_url": result.get("original_image_url", ""),
                         "top_text": result.get("top_text", ""),
                         "bottom_text": result.get("bottom_text", ""),
                     }
-                else:
-                    errors.append(
-                        f"Could not load meme details (HTTP {response.status_code})"
-                    )
 
             except Exception as e:
                 errors.append(f"Error loading meme: {str(e)}")
@@ -163,6 +240,8 @@ def meme_generator(request: HttpRequest) -> HttpResponse:
             "errors": errors,
             "form_data": form_data,
             "meme_image_url": meme_image_url,
+            "meme_pending": meme_pending,
+            "pending_refresh_seconds": PENDING_REFRESH_SECONDS,
             "random_meme_data": random_meme_data,
         },
     )